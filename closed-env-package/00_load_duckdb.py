@@ -8,8 +8,12 @@
 Подготовка данных (в PySpark):
     df = spark.sql("SELECT * FROM schema.my_table")
     df.write.parquet("/path/to/export/my_table.parquet")
+    # партиционированный вывод тоже подойдёт: колонки из col=value/ попадут в таблицу
+    df.write.partitionBy("dt").parquet("/path/to/export/my_table")
     # или
     df.toPandas().to_csv("/path/to/export/my_table.csv", index=False)
+    # для больших CSV можно положить рядом my_table.schema.json с типами колонок
+    # ({"id": "BIGINT", "name": "VARCHAR"}) — тогда автоопределение типов не нужно
 
 Запуск:
     python 00_load_duckdb.py                          # из ./data/
@@ -20,24 +24,231 @@
 
 import os
 import sys
+import json
+import hashlib
 import argparse
+import importlib.util
 from pathlib import Path
 
 
 def ensure_duckdb():
-    """Установить duckdb если нет"""
+    """Импортировать duckdb; если не установлен — завершиться с подсказкой"""
+    if importlib.util.find_spec("duckdb") is None:
+        print("❌ duckdb не установлен. Установите: pip install duckdb")
+        sys.exit(1)
+    import duckdb
+    return duckdb
+
+
+def _fqn(schema, table_name):
+    """Полное имя таблицы для вывода: для схемы main — без префикса"""
+    return f"{schema}.{table_name}" if schema != "main" else table_name
+
+
+def quote_ident(name):
+    """Идентификатор в двойных кавычках — имена файлов с '-', пробелами и т.п. не ломают SQL"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _quoted_fqn(schema, table_name):
+    """Полное имя таблицы для SQL (в кавычках)"""
+    return f"{quote_ident(schema)}.{quote_ident(table_name)}"
+
+
+def _create_tables(conn, schema, jobs):
+    """Создать все таблицы одной транзакцией.
+    Ошибка внутри транзакции DuckDB делает её невалидной, поэтому при сбое
+    транзакция откатывается и таблицы грузятся по одной — так битый файл
+    не мешает загрузке остальных.
+    Возвращает dict: table_name → текст ошибки.
+    """
+    def create(table_name, reader, params):
+        if reader is None:
+            _copy_csv(conn, _quoted_fqn(schema, table_name), *params)
+            return
+        conn.execute(
+            f"CREATE OR REPLACE TABLE {_quoted_fqn(schema, table_name)} AS SELECT * FROM {reader}",
+            params
+        )
+
     try:
-        import duckdb
-        return duckdb
+        conn.execute("BEGIN TRANSACTION")
+        for _, table_name, reader, params in jobs:
+            create(table_name, reader, params)
+        conn.execute("COMMIT")
+        return {}
+    except Exception:
+        conn.execute("ROLLBACK")
+
+    errors = {}
+    for _, table_name, reader, params in jobs:
+        try:
+            create(table_name, reader, params)
+        except Exception as e:
+            errors[table_name] = e
+    return errors
+
+
+def _discover_files(duckdb, data_dir):
+    """Найти Parquet/CSV файлы за один проход по data_dir (os.scandir).
+    Вложенные директории (Spark создаёт директорию с part-файлами) обходит
+    glob() DuckDB одним запросом; part-файлы группируются по директории первого уровня.
+    Возвращает (parquet_files, csv_files, parquet_dirs), где parquet_dirs —
+    dict: директория → список part-файлов.
+    """
+    parquet_files, csv_files, has_dirs = [], [], False
+    with os.scandir(data_dir) as it:
+        for entry in it:
+            if entry.is_file():
+                if entry.name.endswith(".parquet"):
+                    parquet_files.append(Path(entry.path))
+                elif entry.name.endswith(".csv"):
+                    csv_files.append(Path(entry.path))
+            elif entry.is_dir() and not entry.name.startswith("."):
+                has_dirs = True
+
+    parquet_dirs = {}  # директория → её part-файлы
+    if has_dirs:
+        with duckdb.connect() as mem:
+            rows = mem.execute(
+                "SELECT file FROM glob(?) ORDER BY file", [str(data_dir / "*" / "**" / "*.parquet")]
+            ).fetchall()
+        for (f,) in rows:
+            top = Path(f).relative_to(data_dir).parts[0]
+            if not top.startswith("."):
+                parquet_dirs.setdefault(data_dir / top, []).append(Path(f))
+
+    # Сортируем один раз в конце — для детерминированного порядка загрузки и логов
+    return sorted(parquet_files), sorted(csv_files), dict(sorted(parquet_dirs.items()))
+
+
+def _prefetch_files(paths):
+    """Подсказать ОС заранее прочитать файлы в page cache (POSIX_FADV_WILLNEED).
+    Пока DuckDB разбирает первые файлы, остальные уже подтягиваются с диска.
+    На платформах без posix_fadvise (Windows, macOS) ничего не делает.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def _csv_columns(csv_path):
+    """Колонки CSV из <имя>.schema.json ({"колонка": "ТИП", ...}) или None.
+    С sidecar-файлом DuckDB пропускает автоопределение типов (сэмплирование файла).
+    """
+    schema_file = csv_path.with_suffix(".schema.json")
+    if not schema_file.exists():
+        return None
+    with open(schema_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _copy_csv(conn, quoted_table, csv_path, columns):
+    """Загрузить CSV через CREATE TABLE + COPY FROM.
+    COPY пишет row group'ы в таблицу потоком, без промежуточной материализации
+    результата, как у CREATE TABLE AS SELECT * FROM read_csv_auto(...), —
+    память на больших CSV остаётся ограниченной.
+    Без schema.json типы определяются по выборке через DESCRIBE.
+    """
+    if columns is None:
+        columns = {
+            name: col_type
+            for name, col_type, *_ in conn.execute(
+                "DESCRIBE SELECT * FROM read_csv_auto(?)", [csv_path]
+            ).fetchall()
+        }
+        options = "FORMAT CSV, AUTO_DETECT true"
+    else:
+        options = "FORMAT CSV, HEADER true"
+    cols_sql = ", ".join(f"{quote_ident(name)} {col_type}" for name, col_type in columns.items())
+    conn.execute(f"CREATE OR REPLACE TABLE {quoted_table} ({cols_sql})")
+    # COPY не принимает параметр вместо пути — подставляем экранированный литерал
+    path_literal = "'" + csv_path.replace("'", "''") + "'"
+    conn.execute(f"COPY {quoted_table} FROM {path_literal} ({options})")
+
+
+def _total_memory_bytes():
+    """Объём RAM в байтах (psutil, затем sysconf) или None если не определить"""
+    try:
+        import psutil
+        return psutil.virtual_memory().total
     except ImportError:
-        import subprocess
-        print("📦 Установка duckdb...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "--quiet", "duckdb"])
-        import duckdb
-        return duckdb
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
 
+def _configure_ingest(conn, data_dir, preserve_order=False):
+    """Настроить DuckDB на параллельную загрузку с ограничением памяти.
+    preserve_insertion_order=false позволяет сбрасывать готовые row group'ы
+    сразу, не держа всю таблицу в памяти (ценой порядка строк и чуть
+    большего размера файла).
+    """
+    conn.execute(f"PRAGMA threads={os.cpu_count() or 1}")
+    # Кэш метаданных Parquet (footer, статистика row group'ов) между запросами
+    conn.execute("SET enable_object_cache=true")
+    if not preserve_order:
+        conn.execute("SET preserve_insertion_order=false")
 
-def load_files_to_duckdb(data_dir, db_path, schema="main"):
+    total = _total_memory_bytes()
+    if total:
+        mem_gb = max(1, int(total * 0.75 / 2**30))
+        conn.execute(f"SET memory_limit='{mem_gb}GB'")
+
+    tmp = Path(data_dir) / ".duckdb_tmp"
+    tmp.mkdir(exist_ok=True)
+    conn.execute(f"SET temp_directory='{tmp}'")
+
+
+def _fingerprint(paths):
+    """Отпечаток набора файлов: (последний mtime, суммарный размер, sha256-префикс).
+    Хэшируются размеры и первые/последние 64 КБ каждого файла (у Parquet в конце footer),
+    поэтому читать файлы целиком не нужно.
+    """
+    h = hashlib.sha256()
+    mtime, size = 0.0, 0
+    for path in sorted(paths):
+        st = os.stat(path)
+        mtime = max(mtime, st.st_mtime)
+        size += st.st_size
+        h.update(f"{Path(path).name}:{st.st_size}".encode())
+        with open(path, "rb") as f:
+            h.update(f.read(65536))
+            if st.st_size > 131072:
+                f.seek(-65536, os.SEEK_END)
+                h.update(f.read())
+    return mtime, size, h.hexdigest()[:16]
+
+
+def _unchanged_tables(conn, schema, fingerprints):
+    """Имена таблиц, которые уже есть в базе и загружены из тех же файлов"""
+    existing = {r[0] for r in conn.execute(
+        "SELECT table_name FROM duckdb_tables() WHERE schema_name = ?", [schema]
+    ).fetchall()}
+    manifest = {
+        r[0]: tuple(r[1:])
+        for r in conn.execute(
+            "SELECT table_name, mtime, size, sha256_prefix FROM _loader.manifest "
+            "WHERE schema_name = ?", [schema]
+        ).fetchall()
+    }
+    return {t for t, fp in fingerprints.items()
+            if t in existing and manifest.get(t) == fp}
+
+
+def load_files_to_duckdb(data_dir, db_path, schema="main", preserve_order=False, force=False):
     """Загрузить все Parquet/CSV файлы из директории в DuckDB"""
     duckdb = ensure_duckdb()
     
@@ -49,14 +260,7 @@ def load_files_to_duckdb(data_dir, db_path, schema="main"):
         sys.exit(1)
     
     # Собираем файлы
-    parquet_files = sorted(data_dir.glob("*.parquet"))
-    csv_files = sorted(data_dir.glob("*.csv"))
-    
-    # Также ищем Parquet-директории (Spark создаёт директорию с part-файлами)
-    parquet_dirs = []
-    for d in sorted(data_dir.iterdir()):
-        if d.is_dir() and list(d.glob("*.parquet")):
-            parquet_dirs.append(d)
+    parquet_files, csv_files, parquet_dirs = _discover_files(duckdb, data_dir)
     
     total = len(parquet_files) + len(csv_files) + len(parquet_dirs)
     if total == 0:
@@ -101,55 +305,82 @@ print("Готово! Скопируйте файлы в папку data/ пак
     
     # Создаём / открываем DuckDB
     conn = duckdb.connect(str(db_path))
+    _configure_ingest(conn, data_dir, preserve_order)
     
     # Создаём схему если нужно
     if schema != "main":
-        conn.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
-    
-    loaded = 0
+        conn.execute(f"CREATE SCHEMA IF NOT EXISTS {quote_ident(schema)}")
+
+    # Служебная схема с манифестом загруженных файлов (не попадает в модели Cube)
+    conn.execute("CREATE SCHEMA IF NOT EXISTS _loader")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS _loader.manifest ("
+        "schema_name VARCHAR, table_name VARCHAR, source_path VARCHAR, "
+        "mtime DOUBLE, size BIGINT, sha256_prefix VARCHAR, "
+        "PRIMARY KEY (schema_name, table_name))"
+    )
     
-    # Загружаем одиночные Parquet-файлы
+    # Собираем задания на загрузку: (метка, имя таблицы, выражение чтения или None для COPY, параметры)
+    # и исходные файлы каждой таблицы — для проверки, менялись ли они с прошлого запуска
+    jobs = []
+    sources = {}
     for pf in parquet_files:
-        table_name = pf.stem  # users.parquet → users
-        fqn = f"{schema}.{table_name}" if schema != "main" else table_name
-        print(f"  📥 {pf.name} → {fqn}")
-        try:
-            conn.execute(f'CREATE OR REPLACE TABLE {fqn} AS SELECT * FROM read_parquet(\'{pf}\')')
-            count = conn.execute(f"SELECT COUNT(*) FROM {fqn}").fetchone()[0]
-            cols = conn.execute(f"SELECT COUNT(*) FROM information_schema.columns WHERE table_name = '{table_name}'").fetchone()[0]
-            print(f"     ✅ {count} строк, {cols} колонок")
-            loaded += 1
-        except Exception as e:
-            print(f"     ❌ Ошибка: {e}")
-    
-    # Загружаем Parquet-директории (Spark output)
-    for pd in parquet_dirs:
-        table_name = pd.name
-        fqn = f"{schema}.{table_name}" if schema != "main" else table_name
-        glob_path = str(pd / "*.parquet")
-        print(f"  📥 {pd.name}/ (Spark parquet) → {fqn}")
-        try:
-            conn.execute(f"CREATE OR REPLACE TABLE {fqn} AS SELECT * FROM read_parquet('{glob_path}')")
-            count = conn.execute(f"SELECT COUNT(*) FROM {fqn}").fetchone()[0]
-            cols = conn.execute(f"SELECT COUNT(*) FROM information_schema.columns WHERE table_name = '{table_name}'").fetchone()[0]
-            print(f"     ✅ {count} строк, {cols} колонок")
-            loaded += 1
-        except Exception as e:
-            print(f"     ❌ Ошибка: {e}")
-    
-    # Загружаем CSV
+        jobs.append((pf.name, pf.stem, "read_parquet(?)", [str(pf)]))  # users.parquet → users
+        sources[pf.stem] = (pf, [pf])
+    for pd, part_files in parquet_dirs.items():
+        jobs.append((f"{pd.name}/ (Spark parquet)", pd.name,
+                     "read_parquet(?, union_by_name=true, hive_partitioning=true)",
+                     [str(pd / "**" / "*.parquet")]))
+        sources[pd.name] = (pd, part_files)
     for cf in csv_files:
-        table_name = cf.stem
-        fqn = f"{schema}.{table_name}" if schema != "main" else table_name
-        print(f"  📥 {cf.name} → {fqn}")
-        try:
-            conn.execute(f"CREATE OR REPLACE TABLE {fqn} AS SELECT * FROM read_csv_auto('{cf}')")
-            count = conn.execute(f"SELECT COUNT(*) FROM {fqn}").fetchone()[0]
-            cols = conn.execute(f"SELECT COUNT(*) FROM information_schema.columns WHERE table_name = '{table_name}'").fetchone()[0]
-            print(f"     ✅ {count} строк, {cols} колонок")
-            loaded += 1
-        except Exception as e:
-            print(f"     ❌ Ошибка: {e}")
+        jobs.append((cf.name, cf.stem, None, (str(cf), _csv_columns(cf))))  # None → COPY
+        schema_file = cf.with_suffix(".schema.json")
+        sources[cf.stem] = (cf, [cf, schema_file] if schema_file.exists() else [cf])
+
+    # Пропускаем таблицы, исходные файлы которых не менялись с прошлой загрузки
+    fingerprints = {t: _fingerprint(files) for t, (_, files) in sources.items()}
+    unchanged = set() if force else _unchanged_tables(conn, schema, fingerprints)
+    to_load = [job for job in jobs if job[1] not in unchanged]
+
+    # Строки лога копим и выводим одним write — без flush на каждый файл
+    if to_load:
+        print("\n".join(f"  📥 {label} → {_fqn(schema, table_name)}" for label, table_name, _, _ in to_load))
+    if unchanged:
+        print(f"  ⏭️  Без изменений с прошлой загрузки: {len(unchanged)} таблиц")
+
+    _prefetch_files([f for t, (_, files) in sources.items() if t not in unchanged
+                     for f in files if f.suffix == ".parquet"])
+
+    errors = _create_tables(conn, schema, to_load)
+    loaded = len(to_load) - len(errors)
+    manifest_rows = [[schema, t, str(sources[t][0]), *fingerprints[t]]
+                     for _, t, _, _ in to_load if t not in errors]
+    if manifest_rows:
+        conn.executemany(
+            "INSERT OR REPLACE INTO _loader.manifest VALUES (?, ?, ?, ?, ?, ?)", manifest_rows
+        )
+
+    # Статистика по всем таблицам — одним запросом к каталогу, без пересканирования данных
+    stats = {
+        name: (rows, cols)
+        for name, rows, cols in conn.execute(
+            "SELECT table_name, estimated_size, column_count "
+            "FROM duckdb_tables() WHERE schema_name = ?",
+            [schema]
+        ).fetchall()
+    }
+
+    report = [""]
+    for label, table_name, _, _ in jobs:
+        if table_name in errors:
+            report.append(f"  ❌ {label}: {errors[table_name]}")
+            continue
+        count, cols = stats.get(table_name, (None, 0))
+        if count is None:
+            count = conn.execute(f"SELECT COUNT(*) FROM {_quoted_fqn(schema, table_name)}").fetchone()[0]
+        mark = "⏭️ " if table_name in unchanged else "✅"
+        report.append(f"  {mark} {label}: {count} строк, {cols} колонок")
+    print("\n".join(report))
     
     # Итог
     if schema != "main":
@@ -161,7 +392,7 @@ print("Готово! Скопируйте файлы в папку data/ пак
     else:
         all_tables = conn.execute(
             "SELECT table_name FROM information_schema.tables "
-            "WHERE table_type = 'BASE TABLE' ORDER BY table_name"
+            "WHERE table_type = 'BASE TABLE' AND table_schema <> '_loader' ORDER BY table_name"
         ).fetchall()
     
     conn.close()
@@ -198,6 +429,17 @@ def main():
   python 00_load_duckdb.py --data-dir ./data
   python 00_load_duckdb.py --data-dir /export/gp_tables --db ./analytics.duckdb
   python 00_load_duckdb.py --data-dir ./data --schema dbo
+  python 00_load_duckdb.py --data-dir ./data --force   # перезагрузить всё
+
+Повторный запуск загружает только таблицы, чьи файлы изменились
+(манифест хранится в схеме _loader той же базы).
+
+Производительность:
+  Загрузка идёт во все ядра CPU, память ограничена 75% RAM, временные
+  файлы пишутся в <data-dir>/.duckdb_tmp. По умолчанию DuckDB не сохраняет
+  порядок строк (preserve_insertion_order=false): это снижает потребление
+  памяти на больших файлах, но DuckDB-файл может получиться ~на 20% больше.
+  Флаг --preserve-order возвращает исходный порядок строк.
         """
     )
     parser.add_argument("--data-dir", default="./data",
@@ -206,8 +448,17 @@ def main():
                         help="Путь к DuckDB-файлу (default: ./data.duckdb)")
     parser.add_argument("--schema", default="main",
                         help="Схема в DuckDB (default: main)")
+    parser.add_argument("--preserve-order", action="store_true",
+                        help="Сохранять порядок строк из файлов (медленнее, больше памяти)")
+    parser.add_argument("--force", action="store_true",
+                        help="Перезагрузить все таблицы, даже если файлы не менялись")
     
     args = parser.parse_args()
+
+    # Блочная буферизация stdout даже в терминале: лог сбрасывается крупными кусками,
+    # а не системным вызовом на каждую строку
+    if hasattr(sys.stdout, "reconfigure"):
+        sys.stdout.reconfigure(line_buffering=False)
     
     print("=" * 60)
     print("  ЗАГРУЗКА ДАННЫХ В DUCKDB")
@@ -215,7 +466,7 @@ def main():
     print("=" * 60)
     print()
     
-    load_files_to_duckdb(args.data_dir, args.db, args.schema)
+    load_files_to_duckdb(args.data_dir, args.db, args.schema, args.preserve_order, args.force)
 
 
 if __name__ == "__main__":
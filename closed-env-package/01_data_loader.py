@@ -23,6 +23,10 @@ Knowledge Base (опционально):
   --enrich-etl              — обогатить УЖЕ СУЩЕСТВУЮЩИЕ модели через ETL plan
   --enrich-with-llm         — при --enrich-etl переописать колонки через GigaChat
   --model-dir <dir>         — папка с моделями (для --enrich-etl)
+  --exact-counts            — точный COUNT(*) вместо оценки числа строк из каталога БД
+  --bootstrap               — доустановить недостающие пакеты через pip
+  SKIP_BOOTSTRAP=1          — (переменная окружения) не проверять пакеты вовсе —
+                              для образов/CI, где зависимости уже установлены
 
 Запуск:
   Полная генерация:
@@ -38,44 +42,86 @@ Knowledge Base (опционально):
 """
 
 import os
+import re
 import sys
 import subprocess
 import argparse
+import importlib.util
+import threading
+from bisect import bisect_left
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import groupby, islice
 from pathlib import Path
 from datetime import datetime
 
 # ============================================================
-# Автоустановка зависимостей
+# Проверка зависимостей
 # ============================================================
 
-def _ensure_packages():
-    """Проверить и установить недостающие пакеты (базовые)"""
+def _ensure_packages(install=False):
+    """Проверить наличие базовых пакетов (без импорта и без запуска pip).
+    Если чего-то нет — завершиться с подсказкой; с флагом --bootstrap — доустановить.
+    SKIP_BOOTSTRAP=1 в окружении отключает проверку.
+    """
+    if os.environ.get("SKIP_BOOTSTRAP"):
+        return
     required = {
         "yaml": "pyyaml",
         "langchain_gigachat": "langchain-gigachat",
     }
-    missing = []
-    for module, pip_name in required.items():
-        try:
-            __import__(module)
-        except ImportError:
-            missing.append(pip_name)
-    if missing:
-        print(f"📦 Установка недостающих пакетов: {', '.join(missing)}")
-        subprocess.check_call(
-            [sys.executable, "-m", "pip", "install", "--quiet"] + missing
-        )
-        print("✅ Пакеты установлены")
+    missing = [pip_name for module, pip_name in required.items()
+               if importlib.util.find_spec(module) is None]
+    if not missing:
+        return
+    if not install:
+        print(f"❌ Не установлены пакеты: {', '.join(missing)}")
+        print(f"   Установите: pip install {' '.join(missing)}")
+        print(f"   или запустите скрипт с флагом --bootstrap")
+        sys.exit(1)
+    print(f"📦 Установка недостающих пакетов: {', '.join(missing)}")
+    subprocess.check_call(
+        [sys.executable, "-m", "pip", "install", "--quiet"] + missing
+    )
+    print("✅ Пакеты установлены")
 
-_ensure_packages()
+_ensure_packages(install="--bootstrap" in sys.argv)
 
 import yaml
 
+# C-парсер libyaml в 5-10 раз быстрее чистого Python; если PyYAML собран без него — fallback
+try:
+    from yaml import CSafeLoader as _YamlLoader, CSafeDumper as _YamlDumper
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader, SafeDumper as _YamlDumper
+
 # psycopg2 / duckdb подгружаются по необходимости в create_data_source()
 try:
     import psycopg2
+    from psycopg2 import sql as pg_sql
+except ImportError:
+    psycopg2 = pg_sql = None  # Не нужен для duckdb/cube режимов
+
+# orjson (опционально) — в разы быстрее stdlib json на ответах Cube с кириллицей
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# pyahocorasick (опционально) — матч имени таблицы по Knowledge Base за O(len(имени))
+try:
+    import ahocorasick
 except ImportError:
-    psycopg2 = None  # Не нужен для duckdb/cube режимов
+    ahocorasick = None
+
+
+def _json_loads(data):
+    """bytes/str → объект: orjson, если установлен, иначе stdlib json"""
+    if orjson is not None:
+        return orjson.loads(data)
+    import json
+    return json.loads(data)
 
 # ============================================================
 # Загрузка конфигурации
@@ -84,7 +130,7 @@ except ImportError:
 def load_config(config_path="config.yml"):
     """Загрузить конфигурацию из YAML-файла"""
     with open(config_path, 'r', encoding='utf-8') as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=_YamlLoader)
 
 
 # ============================================================
@@ -95,11 +141,16 @@ def create_gigachat(config):
     """Создать клиент GigaChat. Поддерживает 2 режима:
        1. credentials — прямой доступ (SberCloud)
        2. base_url + access_token — через прокси (закрытый контур)
+    gigachat.response_cache_dir включает дисковый кэш ответов (см. _llm_invoke_with_retry).
     """
+    global _LLM_CACHE_DIR
     from langchain_gigachat import GigaChat
     
     gc = config["gigachat"]
     model = gc.get("model", "GigaChat")
+    if gc.get("response_cache_dir"):
+        _LLM_CACHE_DIR = Path(gc["response_cache_dir"]).expanduser()
+        print(f"💾 Кэш ответов GigaChat: {_LLM_CACHE_DIR}")
     
     # Режим 2: через прокси (base_url + access_token из env)
     if gc.get("base_url"):
@@ -141,7 +192,15 @@ def get_db_connection(config):
         port=db["port"],
         dbname=db["name"],
         user=db["user"],
-        password=db["password"]
+        password=db["password"],
+        # Долгие сессии загрузчика (ожидание GigaChat) не должны рваться на NAT/балансировщике;
+        # application_name — чтобы найти их в pg_stat_activity
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=10,
+        keepalives_count=5,
+        connect_timeout=db.get("connect_timeout", 10),
+        application_name="semantic-layer-loader",
     )
 
 
@@ -175,19 +234,22 @@ def get_columns(conn, table_name, schema="public"):
         WHERE table_schema = %s AND table_name = %s
         ORDER BY ordinal_position
     """, (schema, table_name))
-    columns = []
-    for row in cur.fetchall():
-        columns.append({
-            "name": row[0],
-            "data_type": row[1],
-            "nullable": row[2] == "YES",
-            "default": row[3],
-            "max_length": row[4]
-        })
+    columns = [_column_from_row(row) for row in cur.fetchall()]
     cur.close()
     return columns
 
 
+def _column_from_row(row):
+    """Строка information_schema.columns → dict колонки"""
+    return {
+        "name": row[0],
+        "data_type": row[1],
+        "nullable": row[2] == "YES",
+        "default": row[3],
+        "max_length": row[4]
+    }
+
+
 def get_foreign_keys(conn, table_name, schema="public"):
     """Получить внешние ключи таблицы"""
     cur = conn.cursor()
@@ -205,17 +267,20 @@ def get_foreign_keys(conn, table_name, schema="public"):
           AND tc.table_name = %s
           AND tc.table_schema = %s
     """, (table_name, schema))
-    fks = []
-    for row in cur.fetchall():
-        fks.append({
-            "column": row[0],
-            "foreign_table": row[1],
-            "foreign_column": row[2]
-        })
+    fks = [_fk_from_row(row) for row in cur.fetchall()]
     cur.close()
     return fks
 
 
+def _fk_from_row(row):
+    """Строка (column, foreign_table, foreign_column) → dict внешнего ключа"""
+    return {
+        "column": row[0],
+        "foreign_table": row[1],
+        "foreign_column": row[2]
+    }
+
+
 def get_primary_key(conn, table_name, schema="public"):
     """Получить primary key таблицы"""
     cur = conn.cursor()
@@ -233,43 +298,215 @@ def get_primary_key(conn, table_name, schema="public"):
     return result[0] if result else "id"
 
 
-def get_sample_data(conn, table_name, schema="public", limit=5):
-    """Получить примеры данных из таблицы"""
-    cur = conn.cursor()
+# Для примеров данных: json/bytea/xml не берём вовсе, длинный текст обрезаем на сервере —
+# в промпт всё равно попадают первые 60 символов значения, а TOAST-хвосты в килобайты
+# тянуть по сети незачем.
+_SAMPLE_SKIP_TYPES = frozenset({"json", "jsonb", "bytea", "xml", "blob"})
+_SAMPLE_TEXT_TYPES = frozenset({"text", "character varying", "varchar"})
+_SAMPLE_TEXT_CHARS = 200
+
+
+def _quote_ident(name):
+    """Идентификатор в двойных кавычках (кавычки внутри имени удваиваются)"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _sample_select_list(columns):
+    """SELECT-список для примеров данных по уже прочитанным колонкам таблицы.
+    Без колонок (или если отброшены все) — '*'.
+    """
+    exprs = []
+    for col in columns or ():
+        data_type = (col.get("data_type") or "").lower()
+        if data_type in _SAMPLE_SKIP_TYPES:
+            continue
+        name = _quote_ident(col["name"])
+        if data_type in _SAMPLE_TEXT_TYPES and not col.get("max_length"):
+            exprs.append(f'left({name}, {_SAMPLE_TEXT_CHARS}) AS {name}')
+        else:
+            exprs.append(name)
+    return ", ".join(exprs) or "*"
+
+
+def get_sample_data(conn, table_name, schema="public", limit=5, columns=None):
+    """Получить примеры данных из таблицы.
+    Именованный (server-side) курсор отдаёт строки порциями по itersize,
+    поэтому при большом limit результат не материализуется целиком на клиенте.
+    columns — колонки таблицы (из get_columns): если переданы, тяжёлые типы
+    не выбираются, а длинный текст обрезается (см. _sample_select_list).
+    """
+    cur = conn.cursor(name="sample_cur")
+    cur.itersize = limit
     try:
-        cur.execute(f'SELECT * FROM {schema}."{table_name}" LIMIT %s', (limit,))
+        cur.execute(pg_sql.SQL("SELECT {} FROM {}.{} LIMIT %s").format(
+            pg_sql.SQL(_sample_select_list(columns)),
+            pg_sql.Identifier(schema), pg_sql.Identifier(table_name)), (limit,))
+        rows = cur.fetchmany(limit)
         columns = [desc[0] for desc in cur.description]
-        rows = cur.fetchall()
         cur.close()
         return columns, rows
     except Exception:
-        cur.close()
+        conn.rollback()
         return [], []
 
 
-def get_row_count(conn, table_name, schema="public"):
-    """Получить количество строк"""
+def get_row_count(conn, table_name, schema="public", exact=False, estimates=None):
+    """Получить количество строк.
+    Сначала берём оценку из каталога (pg_class.reltuples, обновляется ANALYZE/VACUUM) —
+    для описаний в промпте точное число не нужно. COUNT(*) — только если оценки нет
+    или запрошен точный подсчёт (exact=True, флаг --exact-counts).
+    estimates — готовые оценки всей схемы (get_all_row_estimates), чтобы не спрашивать
+    каталог по каждой таблице.
+    """
     cur = conn.cursor()
-    cur.execute(f'SELECT COUNT(*) FROM {schema}."{table_name}"')
-    count = cur.fetchone()[0]
+    count = None
+    if not exact and estimates is not None:
+        count = estimates.get(table_name)
+    elif not exact:
+        cur.execute("""
+            SELECT c.reltuples::bigint
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relname = %s
+        """, (schema, table_name))
+        row = cur.fetchone()
+        count = row[0] if row else None
+    if not count or count < 0:
+        cur.execute(pg_sql.SQL("SELECT COUNT(*) FROM {}.{}").format(
+            pg_sql.Identifier(schema), pg_sql.Identifier(table_name)))
+        count = cur.fetchone()[0]
     cur.close()
     return count
 
 
+def _group_by_table(rows, make):
+    """[(table_name, *rest), ...] (отсортировано по table_name) → {table_name: [make(rest), ...]}"""
+    return {t: [make(r[1:]) for r in grp] for t, grp in groupby(rows, key=lambda r: r[0])}
+
+
+def _first_by_table(rows):
+    """[(table_name, value), ...] → {table_name: первое value}"""
+    result = {}
+    for t, value in rows:
+        result.setdefault(t, value)
+    return result
+
+
+def get_all_columns(conn, schema="public"):
+    """Колонки всех таблиц схемы одним запросом: {table_name: [column, ...]}"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT table_name, column_name, data_type, is_nullable, column_default,
+               character_maximum_length
+        FROM information_schema.columns
+        WHERE table_schema = %s
+        ORDER BY table_name, ordinal_position
+    """, (schema,))
+    rows = cur.fetchall()
+    cur.close()
+    return _group_by_table(rows, _column_from_row)
+
+
+def get_all_foreign_keys(conn, schema="public"):
+    """Внешние ключи всех таблиц схемы одним запросом: {table_name: [fk, ...]}"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT
+            tc.table_name,
+            kcu.column_name,
+            ccu.table_name AS foreign_table,
+            ccu.column_name AS foreign_column
+        FROM information_schema.table_constraints AS tc
+        JOIN information_schema.key_column_usage AS kcu
+            ON tc.constraint_name = kcu.constraint_name
+        JOIN information_schema.constraint_column_usage AS ccu
+            ON ccu.constraint_name = tc.constraint_name
+        WHERE tc.constraint_type = 'FOREIGN KEY'
+          AND tc.table_schema = %s
+        ORDER BY tc.table_name
+    """, (schema,))
+    rows = cur.fetchall()
+    cur.close()
+    return _group_by_table(rows, _fk_from_row)
+
+
+def get_all_primary_keys(conn, schema="public"):
+    """Primary key всех таблиц схемы одним запросом: {table_name: column}"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT tc.table_name, kcu.column_name
+        FROM information_schema.table_constraints tc
+        JOIN information_schema.key_column_usage kcu
+            ON tc.constraint_name = kcu.constraint_name
+        WHERE tc.constraint_type = 'PRIMARY KEY'
+          AND tc.table_schema = %s
+    """, (schema,))
+    rows = cur.fetchall()
+    cur.close()
+    return _first_by_table(rows)
+
+
+def get_all_row_estimates(conn, schema="public"):
+    """Оценки числа строк всех таблиц схемы из pg_class одним запросом: {table_name: reltuples}"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT c.relname, c.reltuples::bigint
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relkind IN ('r', 'p')
+    """, (schema,))
+    rows = cur.fetchall()
+    cur.close()
+    return dict(rows)
+
+
 # ============================================================
 # Чтение структуры из DuckDB
 # ============================================================
 
+# Открытые read-only соединения DuckDB: абсолютный путь → [соединение, число источников].
+# Повторные DuckDBSource к тому же файлу переиспользуют соединение и его кэш
+# метаданных (enable_object_cache), а не открывают базу заново.
+_DUCKDB_CONN_CACHE = {}
+
+
+def _open_duckdb(db_path):
+    key = str(Path(db_path).resolve())
+    entry = _DUCKDB_CONN_CACHE.get(key)
+    if entry is None:
+        import duckdb
+        conn = duckdb.connect(db_path, config={
+            "access_mode": "READ_ONLY",
+            "enable_object_cache": True,
+            "threads": os.cpu_count() or 1,
+        })
+        entry = _DUCKDB_CONN_CACHE[key] = [conn, 0]
+    entry[1] += 1
+    return entry[0], key
+
+
+def _release_duckdb(key):
+    entry = _DUCKDB_CONN_CACHE.get(key)
+    if entry is None:
+        return
+    entry[1] -= 1
+    if entry[1] <= 0:
+        del _DUCKDB_CONN_CACHE[key]
+        entry[0].close()
+
+
 class DuckDBSource:
     """Источник данных — локальный DuckDB-файл.
     Реализует тот же интерфейс что и psycopg2-функции выше.
     """
 
     def __init__(self, config):
-        import duckdb
         db_path = config["database"].get("path", "./data.duckdb")
         self.schema = config["database"].get("schema", "main")
-        self.conn = duckdb.connect(db_path, read_only=True)
+        self.conn, self._cache_key = _open_duckdb(db_path)
+        self.exact_counts = config["database"].get("exact_counts", False)
+        self._meta = None
+        self._samples = {}
         print(f"✅ DuckDB: {db_path} (schema={self.schema})")
 
     def get_tables(self):
@@ -281,82 +518,148 @@ class DuckDBSource:
         ).fetchall()
         return [r[0] for r in rows]
 
+    def _prefetched(self):
+        """Колонки, FK, PK и оценки числа строк всех таблиц схемы — при первом обращении;
+        дальше get_columns / get_foreign_keys / get_primary_key / get_row_count отвечают из памяти."""
+        if self._meta is None:
+            self._meta = (self._fetch_all_columns(), self._fetch_all_foreign_keys(),
+                          self._fetch_all_primary_keys(),
+                          None if self.exact_counts else self._fetch_row_estimates())
+        return self._meta
+
     def get_columns(self, table_name):
+        return self._prefetched()[0].get(table_name, [])
+
+    def get_foreign_keys(self, table_name):
+        return self._prefetched()[1].get(table_name, [])
+
+    def get_primary_key(self, table_name):
+        return self._prefetched()[2].get(table_name, "id")
+
+    def get_all_columns(self):
+        return self._prefetched()[0]
+
+    def get_all_foreign_keys(self):
+        return self._prefetched()[1]
+
+    def get_all_primary_keys(self):
+        return self._prefetched()[2]
+
+    def _fetch_all_columns(self):
         rows = self.conn.execute(
-            "SELECT column_name, data_type, is_nullable, column_default, "
+            "SELECT table_name, column_name, data_type, is_nullable, column_default, "
             "character_maximum_length "
             "FROM information_schema.columns "
-            "WHERE table_schema = ? AND table_name = ? "
-            "ORDER BY ordinal_position",
-            [self.schema, table_name]
+            "WHERE table_schema = ? "
+            "ORDER BY table_name, ordinal_position",
+            [self.schema]
         ).fetchall()
-        return [{
-            "name": r[0],
-            "data_type": r[1],
-            "nullable": r[2] == "YES",
-            "default": r[3],
-            "max_length": r[4]
-        } for r in rows]
+        return _group_by_table(rows, _column_from_row)
 
-    def get_foreign_keys(self, table_name):
+    def _fetch_all_foreign_keys(self):
         # DuckDB поддерживает FK, но не всегда заполняет information_schema
         try:
             rows = self.conn.execute(
-                "SELECT kcu.column_name, ccu.table_name, ccu.column_name "
+                "SELECT tc.table_name, kcu.column_name, ccu.table_name, ccu.column_name "
                 "FROM information_schema.table_constraints tc "
                 "JOIN information_schema.key_column_usage kcu "
                 "  ON tc.constraint_name = kcu.constraint_name "
                 "JOIN information_schema.constraint_column_usage ccu "
                 "  ON ccu.constraint_name = tc.constraint_name "
-                "WHERE tc.constraint_type = 'FOREIGN KEY' "
-                "  AND tc.table_name = ? AND tc.table_schema = ?",
-                [table_name, self.schema]
+                "WHERE tc.constraint_type = 'FOREIGN KEY' AND tc.table_schema = ? "
+                "ORDER BY tc.table_name",
+                [self.schema]
             ).fetchall()
-            return [{"column": r[0], "foreign_table": r[1], "foreign_column": r[2]}
-                    for r in rows]
+            return _group_by_table(rows, _fk_from_row)
         except Exception:
-            return []
+            return {}
 
-    def get_primary_key(self, table_name):
+    def _fetch_all_primary_keys(self):
         try:
             rows = self.conn.execute(
-                "SELECT kcu.column_name "
+                "SELECT tc.table_name, kcu.column_name "
                 "FROM information_schema.table_constraints tc "
                 "JOIN information_schema.key_column_usage kcu "
                 "  ON tc.constraint_name = kcu.constraint_name "
-                "WHERE tc.constraint_type = 'PRIMARY KEY' "
-                "  AND tc.table_name = ? AND tc.table_schema = ?",
-                [table_name, self.schema]
+                "WHERE tc.constraint_type = 'PRIMARY KEY' AND tc.table_schema = ?",
+                [self.schema]
             ).fetchall()
-            return rows[0][0] if rows else "id"
+            return _first_by_table(rows)
         except Exception:
-            return "id"
+            return {}
 
     def get_sample_data(self, table_name, limit=5):
+        key = (table_name, limit)
+        if key not in self._samples:
+            self._samples[key] = self._fetch_sample_data(table_name, limit)
+        return self._samples[key]
+
+    def _fetch_sample_data(self, table_name, limit):
+        select = _sample_select_list(self.get_columns(table_name))
         try:
             result = self.conn.execute(
-                f'SELECT * FROM {self.schema}."{table_name}" LIMIT ?', [limit]
+                f'SELECT {select} FROM {_quote_ident(self.schema)}.{_quote_ident(table_name)} LIMIT ?',
+                [limit]
             )
             columns = [desc[0] for desc in result.description]
-            rows = result.fetchall()
+            rows = result.fetchmany(limit)
             return columns, rows
         except Exception:
             return [], []
 
+    def _fetch_row_estimates(self):
+        rows = self.conn.execute(
+            "SELECT table_name, estimated_size FROM duckdb_tables() WHERE schema_name = ?",
+            [self.schema]
+        ).fetchall()
+        return dict(rows)
+
     def get_row_count(self, table_name):
+        # Оценка из каталога DuckDB — без сканирования таблицы (если не --exact-counts)
+        estimates = self._prefetched()[3]
+        if estimates and estimates.get(table_name):
+            return estimates[table_name]
         result = self.conn.execute(
-            f'SELECT COUNT(*) FROM {self.schema}."{table_name}"'
+            f'SELECT COUNT(*) FROM {_quote_ident(self.schema)}.{_quote_ident(table_name)}'
         )
         return result.fetchone()[0]
 
+    def clone(self):
+        """Копия источника со своим соединением к той же базе — для работы в другом потоке"""
+        other = object.__new__(DuckDBSource)
+        other.schema = self.schema
+        other.exact_counts = self.exact_counts
+        other.conn = self.conn.cursor()
+        other._cache_key = None
+        other._meta = self._meta
+        other._samples = self._samples
+        return other
+
     def close(self):
-        self.conn.close()
+        if self.conn is None:
+            return
+        if self._cache_key:
+            _release_duckdb(self._cache_key)
+        else:
+            self.conn.close()
+        self.conn = None
 
 
 # ============================================================
 # Чтение метаданных из работающего Cube API
 # ============================================================
 
+def _column_from_dimension(dim):
+    """Измерение из Cube /meta → dict колонки (как у _column_from_row)"""
+    return {
+        "name": dim["name"].split(".")[-1],
+        "data_type": dim.get("type", "string"),
+        "nullable": True,
+        "default": None,
+        "max_length": None
+    }
+
+
 class CubeAPISource:
     """Источник данных — метаданные из Cube REST API /meta.
     Не требует подключения к БД вообще.
@@ -372,72 +675,152 @@ class CubeAPISource:
         if token:
             headers["Authorization"] = f"Bearer {token}"
 
-        resp = httpx.get(f"{self.cube_url}/meta", headers=headers, timeout=15.0)
-        resp.raise_for_status()
-        self.meta = resp.json()
+        # Одно keep-alive соединение на все запросы (HTTP/2 — если установлен h2)
+        try:
+            import h2  # noqa: F401
+            http2 = True
+        except ImportError:
+            http2 = False
+        self.client = httpx.Client(
+            headers=headers, timeout=15.0, http2=http2,
+            limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=30.0)
+        )
+
+        self.meta_cache_ttl = config["cube"].get("meta_cache_ttl", 300)
+        self.meta = self._load_meta(token)
         self.cubes = {c["name"]: c for c in self.meta.get("cubes", [])}
+        # Колонки, PK и count-меры всех кубов — один проход по /meta,
+        # дальше get_columns / get_primary_key отвечают из словарей
+        self._columns = {name: [_column_from_dimension(d) for d in c.get("dimensions", [])]
+                         for name, c in self.cubes.items()}
+        self._pk = {name: next((d["name"].split(".")[-1] for d in c.get("dimensions", [])
+                                if d.get("primaryKey")), "id")
+                    for name, c in self.cubes.items()}
+        self._count_measures = {name: next((m["name"] for m in c.get("measures", [])
+                                            if m.get("type") == "count"), None)
+                                for name, c in self.cubes.items()}
+        self._row_counts = None
         print(f"✅ Cube API: {len(self.cubes)} кубов загружено из {self.cube_url}")
 
+    def _load_meta(self, token):
+        """GET /meta с дисковым кэшем в ~/.cache.
+        Кэш моложе cube.meta_cache_ttl секунд (по умолчанию 5 минут, 0 — выключить)
+        используется без запроса. Иначе, если Cube отдал ETag, шлём If-None-Match и при 304
+        берём сохранённый ответ вместо повторной загрузки всех метаданных.
+        """
+        import hashlib
+        import json
+        import time
+
+        key = hashlib.sha256(f"{self.cube_url}|{token}".encode()).hexdigest()[:16]
+        cache_file = Path.home() / ".cache" / f"cube_meta_{key}.json"
+        try:
+            cached = _json_loads(cache_file.read_bytes())
+            cache_age = time.time() - cache_file.stat().st_mtime
+        except (OSError, ValueError):
+            cached = None
+        if cached and cache_age < self.meta_cache_ttl:
+            return cached["meta"]
+
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+
+        resp = self.client.get(f"{self.cube_url}/meta", headers=headers)
+        if resp.status_code == 304 and cached:
+            cache_file.touch()  # подтверждён сервером — TTL отсчитывается заново
+            return cached["meta"]
+        resp.raise_for_status()
+        meta = _json_loads(resp.content)
+
+        etag = resp.headers.get("ETag")
+        if etag or self.meta_cache_ttl:
+            try:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                cache = {"etag": etag, "meta": meta}
+                cache_file.write_bytes(orjson.dumps(cache) if orjson is not None
+                                       else json.dumps(cache).encode("utf-8"))
+            except OSError:
+                pass
+        return meta
+
     def get_tables(self):
         return sorted(self.cubes.keys())
 
     def get_columns(self, table_name):
-        cube = self.cubes.get(table_name, {})
-        columns = []
-        for dim in cube.get("dimensions", []):
-            short_name = dim["name"].split(".")[-1]
-            columns.append({
-                "name": short_name,
-                "data_type": dim.get("type", "string"),
-                "nullable": True,
-                "default": None,
-                "max_length": None
-            })
-        return columns
+        return self._columns.get(table_name, [])
 
     def get_foreign_keys(self, table_name):
         # Cube API не отдаёт FK — joins обнаружим по именам колонок
         return []
 
     def get_primary_key(self, table_name):
-        cube = self.cubes.get(table_name, {})
-        for dim in cube.get("dimensions", []):
-            if dim.get("primaryKey"):
-                return dim["name"].split(".")[-1]
-        return "id"
+        return self._pk.get(table_name, "id")
+
+    def get_all_columns(self):
+        return self._columns
+
+    def get_all_foreign_keys(self):
+        return {}
+
+    def get_all_primary_keys(self):
+        return self._pk
 
     def get_sample_data(self, table_name, limit=5):
         # Не можем получить sample data через Cube API
         return [], []
 
-    def get_row_count(self, table_name):
-        # Пробуем count из Cube
-        import httpx
-        cube = self.cubes.get(table_name, {})
-        count_measure = None
-        for m in cube.get("measures", []):
-            if m.get("type") == "count":
-                count_measure = m["name"]
-                break
-        if not count_measure:
-            return 0
+    def _load_count(self, count_measure):
         try:
-            headers = {"Content-Type": "application/json"}
-            resp = httpx.post(
+            resp = self.client.post(
                 f"{self.cube_url}/load",
                 json={"query": {"measures": [count_measure], "limit": 1}},
-                headers=headers,
-                timeout=15.0
             )
-            data = resp.json().get("data", [])
+            data = _json_loads(resp.content).get("data", [])
             if data:
                 return list(data[0].values())[0]
         except Exception:
             pass
         return 0
 
+    def get_row_counts(self):
+        """Количество строк всех кубов одним POST /load (Cube принимает массив запросов).
+        Результат кэшируется; если пакетный запрос не прошёл (старый Cube без multi-query) —
+        считаем по одному кубу, параллельно через общий httpx.Client (он потокобезопасен).
+        """
+        if self._row_counts is not None:
+            return self._row_counts
+
+        measures = {name: m for name, m in self._count_measures.items() if m}
+
+        counts = {name: 0 for name in self.cubes}
+        if measures:
+            try:
+                resp = self.client.post(
+                    f"{self.cube_url}/load",
+                    json={"query": [{"measures": [m], "limit": 1} for m in measures.values()]},
+                )
+                resp.raise_for_status()
+                results = _json_loads(resp.content).get("results", [])
+                if len(results) != len(measures):
+                    raise ValueError("неполный ответ multi-query")
+                for (name, m), res in zip(measures.items(), results):
+                    data = res.get("data", [])
+                    if data:
+                        counts[name] = data[0].get(m, 0)
+            except Exception:
+                with ThreadPoolExecutor(max_workers=8) as ex:
+                    counts.update(zip(measures, ex.map(self._load_count, measures.values())))
+
+        self._row_counts = counts
+        return counts
+
+    def get_row_count(self, table_name):
+        # Пробуем count из Cube (все кубы сразу, при первом обращении)
+        return self.get_row_counts().get(table_name, 0)
+
     def close(self):
-        pass
+        self.client.close()
 
 
 # ============================================================
@@ -459,7 +842,8 @@ def create_data_source(config, override_source=None):
     elif driver in ("postgresql", "postgres"):
         conn = get_db_connection(config)
         schema = get_schema(config)
-        return _PsycopgSource(conn, schema), driver
+        return _PsycopgSource(conn, schema, connect=lambda: get_db_connection(config),
+                              exact_counts=config["database"].get("exact_counts", False)), driver
     elif driver == "greenplum":
         from db_sources import GreenplumSource
         return GreenplumSource(config), driver
@@ -473,49 +857,147 @@ def create_data_source(config, override_source=None):
 
 
 class _PsycopgSource:
-    """Обёртка над psycopg2 для единого интерфейса."""
-    def __init__(self, conn, schema):
+    """Обёртка над psycopg2 для единого интерфейса.
+    Колонки, FK, PK и оценки числа строк всех таблиц схемы читаются четырьмя запросами
+    при первом обращении (вместо запросов на каждую таблицу) и дальше отдаются из памяти.
+    """
+
+    def __init__(self, conn, schema, connect=None, exact_counts=False):
         self.conn = conn
         self.schema = schema
+        self._connect = connect
+        self.exact_counts = exact_counts
+        self._meta = None
+        self._samples = {}
+
+    def _prefetched(self):
+        if self._meta is None:
+            self._meta = (get_all_columns(self.conn, self.schema),
+                          get_all_foreign_keys(self.conn, self.schema),
+                          get_all_primary_keys(self.conn, self.schema),
+                          None if self.exact_counts else get_all_row_estimates(self.conn, self.schema))
+        return self._meta
 
     def get_tables(self):
         return get_tables(self.conn, self.schema)
 
     def get_columns(self, table_name):
-        return get_columns(self.conn, table_name, self.schema)
+        return self._prefetched()[0].get(table_name, [])
 
     def get_foreign_keys(self, table_name):
-        return get_foreign_keys(self.conn, table_name, self.schema)
+        return self._prefetched()[1].get(table_name, [])
 
     def get_primary_key(self, table_name):
-        return get_primary_key(self.conn, table_name, self.schema)
+        return self._prefetched()[2].get(table_name, "id")
+
+    def get_all_columns(self):
+        return self._prefetched()[0]
+
+    def get_all_foreign_keys(self):
+        return self._prefetched()[1]
+
+    def get_all_primary_keys(self):
+        return self._prefetched()[2]
 
     def get_sample_data(self, table_name, limit=5):
-        return get_sample_data(self.conn, table_name, self.schema, limit)
+        # Примеры одной таблицы запрашиваются повторно (интроспекция, --enrich-etl) — кешируем
+        key = (table_name, limit)
+        if key not in self._samples:
+            self._samples[key] = get_sample_data(self.conn, table_name, self.schema, limit,
+                                                 columns=self.get_columns(table_name))
+        return self._samples[key]
 
     def get_row_count(self, table_name):
-        return get_row_count(self.conn, table_name, self.schema)
+        return get_row_count(self.conn, table_name, self.schema, exact=self.exact_counts,
+                             estimates=self._prefetched()[3])
+
+    def clone(self):
+        """Копия источника с новым соединением — psycopg2-соединение нельзя делить между потоками"""
+        other = _PsycopgSource(self._connect(), self.schema, self._connect, self.exact_counts)
+        other._meta = self._meta
+        other._samples = self._samples
+        return other
 
     def close(self):
         self.conn.close()
 
 
+def introspect_tables(source, tables, max_workers=8):
+    """Прочитать структуру, количество строк и примеры данных для всех таблиц.
+    Колонки/FK/PK берутся пакетно, если источник это умеет. Остальные запросы
+    к БД (count, sample) идут параллельно: каждый поток работает со своей копией
+    источника (source.clone()). Источники без clone() читаются последовательно.
+    Возвращает dict: table → {columns, fks, pk, row_count, sample_cols, sample_rows}.
+    """
+    batch_meta = hasattr(source, "get_all_columns")
+    if batch_meta:
+        all_columns = source.get_all_columns()
+        all_fks = source.get_all_foreign_keys()
+        all_pks = source.get_all_primary_keys()
+
+    parallel = hasattr(source, "clone") and len(tables) > 1
+    local = threading.local()
+    clones = []
+
+    def worker_source():
+        src = getattr(local, "source", None)
+        if src is None:
+            src = local.source = source.clone()
+            clones.append(src)
+        return src
+
+    def introspect_one(table):
+        src = worker_source() if parallel else source
+        if batch_meta:
+            columns = all_columns.get(table, [])
+            fks = all_fks.get(table, [])
+            pk = all_pks.get(table, "id")
+        else:
+            columns = src.get_columns(table)
+            fks = src.get_foreign_keys(table)
+            pk = src.get_primary_key(table)
+        sample_cols, sample_rows = src.get_sample_data(table, 5)
+        return {
+            "columns": columns,
+            "fks": fks,
+            "pk": pk,
+            "row_count": src.get_row_count(table),
+            "sample_cols": sample_cols,
+            "sample_rows": sample_rows,
+        }
+
+    if not parallel:
+        return {t: introspect_one(t) for t in tables}
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            return dict(zip(tables, ex.map(introspect_one, tables)))
+    finally:
+        for src in clones:
+            src.close()
+
+
 # ============================================================
 # Knowledge Base — загрузка внешних подсказок для таблиц
 # ============================================================
 
 _KNOWLEDGE_BASE = {}  # Загружается из внешнего YAML-файла
+_KB_INDEX = ()        # Предрасчитанные формы паттернов KB (см. _build_kb_index)
+_KB_AUTOMATON = None  # Aho-Corasick по формам паттернов KB (если установлен pyahocorasick)
 
 
 def load_knowledge_base(kb_path: str) -> dict:
     """Загрузить Knowledge Base из YAML-файла.
     Возвращает dict: pattern_name → {title, description, column_hints, suggested_measures}.
     """
-    global _KNOWLEDGE_BASE
+    global _KNOWLEDGE_BASE, _KB_INDEX, _KB_AUTOMATON
     try:
-        with open(kb_path, 'r', encoding='utf-8') as f:
-            data = yaml.safe_load(f) or {}
+        # Байты напрямую в libyaml (CSafeLoader сам определяет кодировку) — без декодирования в str
+        with open(kb_path, 'rb') as f:
+            data = yaml.load(f, Loader=_YamlLoader) or {}
         _KNOWLEDGE_BASE = data
+        _KB_INDEX = _build_kb_index(data)
+        _KB_AUTOMATON = _build_kb_automaton(_KB_INDEX)
+        _match_kb_pattern.cache_clear()
         print(f"✅ Knowledge Base загружена: {len(data)} паттернов из {kb_path}")
         return data
     except FileNotFoundError:
@@ -526,47 +1008,52 @@ def load_knowledge_base(kb_path: str) -> dict:
         return {}
 
 
+# Колонки ETL plan → поля записи (остальные колонки файла игнорируются)
+_ETL_PLAN_FIELDS = {
+    "source_schema": "source_schema",
+    "source_cluster": "source_cluster",
+    "table_step2": "target_table",
+    "process_description": "process_description",
+    "last_updated_time": "last_updated",
+}
+
+
+def _read_etl_plan_frame(plan_path: str):
+    """ETL plan → DataFrame строк (все значения — str, пустые — "").
+    xlsx читается движком calamine (Rust, pandas >= 2.2 + python-calamine), без него — openpyxl.
+    """
+    import pandas as pd
+
+    if plan_path.lower().endswith(".csv"):
+        df = pd.read_csv(plan_path, dtype=str, keep_default_na=False, encoding="utf-8")
+    else:
+        try:
+            df = pd.read_excel(plan_path, engine="calamine", dtype=str)
+        except (ImportError, ValueError):
+            df = pd.read_excel(plan_path, engine="openpyxl", dtype=str)
+    df.columns = df.columns.astype(str).str.strip().str.lower()
+    return df.fillna("")
+
+
 def load_etl_plan(plan_path: str) -> dict:
     """Загрузить ETL execution plan файл (xlsx/csv).
     Возвращает dict: source_table_name → {columns from plan}.
     """
-    info = {}
-    plan_path_lower = plan_path.lower()
+    if not plan_path.lower().endswith((".xlsx", ".xls", ".csv")):
+        print(f"⚠️  Неподдерживаемый формат ETL plan: {plan_path}. Используйте .xlsx или .csv")
+        return {}
 
     try:
-        if plan_path_lower.endswith(".xlsx") or plan_path_lower.endswith(".xls"):
-            import openpyxl
-            wb = openpyxl.load_workbook(plan_path, data_only=True)
-            ws = wb.active
-            headers = [str(c.value or "").strip().lower() for c in ws[1]]
-            for row in ws.iter_rows(min_row=2, values_only=True):
-                rec = dict(zip(headers, row))
-                src_table = str(rec.get("source_table", "") or "").strip()
-                if src_table:
-                    info[src_table] = {
-                        "source_schema": str(rec.get("source_schema", "") or ""),
-                        "source_cluster": str(rec.get("source_cluster", "") or ""),
-                        "target_table": str(rec.get("table_step2", "") or ""),
-                        "process_description": str(rec.get("process_description", "") or "")[:500],
-                        "last_updated": str(rec.get("last_updated_time", "") or ""),
-                    }
-        elif plan_path_lower.endswith(".csv"):
-            import csv
-            with open(plan_path, "r", encoding="utf-8") as f:
-                reader = csv.DictReader(f)
-                for rec in reader:
-                    src_table = rec.get("source_table", "").strip()
-                    if src_table:
-                        info[src_table] = {
-                            "source_schema": rec.get("source_schema", ""),
-                            "source_cluster": rec.get("source_cluster", ""),
-                            "target_table": rec.get("table_step2", ""),
-                            "process_description": rec.get("process_description", "")[:500],
-                            "last_updated": rec.get("last_updated_time", ""),
-                        }
-        else:
-            print(f"⚠️  Неподдерживаемый формат ETL plan: {plan_path}. Используйте .xlsx или .csv")
-            return {}
+        df = _read_etl_plan_frame(plan_path)
+        df = df.reindex(columns=["source_table", *_ETL_PLAN_FIELDS], fill_value="")
+        df["source_table"] = df["source_table"].str.strip()
+        df = df[df["source_table"] != ""]
+        df["process_description"] = df["process_description"].str.slice(0, 500)
+        records = df[list(_ETL_PLAN_FIELDS)].rename(columns=_ETL_PLAN_FIELDS).to_dict("records")
+        # Повтор таблицы в плане — как раньше: значения последней строки, позиция первой
+        info = {}
+        for src_table, rec in zip(df["source_table"], records):
+            info[src_table] = rec
 
         print(f"✅ ETL plan загружен: {len(info)} source-таблиц из {plan_path}")
         for t in info:
@@ -578,8 +1065,11 @@ def load_etl_plan(plan_path: str) -> dict:
         return {}
 
 
-def _singularize(word: str) -> set:
-    """Вернуть множество возможных единственных форм для английского слова."""
+@lru_cache(maxsize=4096)
+def _singularize(word: str) -> frozenset:
+    """Вернуть множество возможных единственных форм для английского слова.
+    Кэшируется: одни и те же имена таблиц и паттернов KB разбираются многократно.
+    """
     forms = {word}
     if word.endswith("ies") and len(word) > 4:
         forms.add(word[:-3] + "y")          # priorities → priority
@@ -589,53 +1079,126 @@ def _singularize(word: str) -> set:
         forms.add(word[:-2])                # statuses → status
     if word.endswith("s") and not word.endswith("ss"):
         forms.add(word[:-1])                # issues → issue
-    return forms
+    return frozenset(forms)
 
 
-def match_kb_hints(table_name: str, etl_plan: dict = None) -> dict:
-    """Найти подсказки из Knowledge Base для таблицы.
-    Сопоставление учитывает подчёркивания (issue_links ↔ issuelink),
-    множественное число (priorities ↔ priority), префиксы (jiraissue ↔ issues).
-    """
-    tl = table_name.lower()
-    tl_no_sep = tl.replace("_", "").replace("-", "")
-    tl_singulars = _singularize(tl_no_sep)
+# Доменные префиксы паттернов KB: jiraissue → issue, projectversion → version
+_KB_PREFIX_RE = re.compile(r'jira|project')
+
 
-    for pattern, hints in _KNOWLEDGE_BASE.items():
+def _build_kb_index(kb: dict) -> tuple:
+    """Нормализовать паттерны KB один раз при загрузке.
+    Элемент: (pattern, pat_no_sep, pat_singulars, core_singulars), где core — паттерн
+    без префикса jira/project (пустое множество, если префикса нет).
+    """
+    index = []
+    for pattern in kb:
         pat_no_sep = pattern.replace("_", "")
-        pat_singulars = _singularize(pat_no_sep)
+        prefix = _KB_PREFIX_RE.match(pat_no_sep)
+        index.append((
+            pattern,
+            pat_no_sep,
+            _singularize(pat_no_sep),
+            _singularize(pat_no_sep[prefix.end():]) if prefix else frozenset(),
+        ))
+    return tuple(index)
+
+
+def _build_kb_automaton(kb_index: tuple):
+    """Собрать автомат Aho-Corasick по индексу KB.
+    Ключи — формы паттерна без "_" (с единственным числом) и ядра jira*/project*,
+    значение — (форма, [(позиция паттерна в KB, паттерн, это ядро?), ...]).
+    Без pyahocorasick — None (match_kb_hints перебирает паттерны линейно).
+    """
+    if ahocorasick is None or not kb_index:
+        return None
+    forms = {}
+    for pos, (pattern, _, pat_singulars, core_singulars) in enumerate(kb_index):
+        for form in pat_singulars:
+            forms.setdefault(form, []).append((pos, pattern, False))
+        for form in core_singulars:
+            forms.setdefault(form, []).append((pos, pattern, True))
+
+    automaton = ahocorasick.Automaton()
+    for form, refs in forms.items():
+        if form:
+            automaton.add_word(form, (form, refs))
+    automaton.make_automaton()
+    return automaton
+
+
+def _match_kb_automaton(tl_no_sep: str, tl_singulars: set):
+    """Первый (в порядке KB) паттерн, подходящий по правилам 1-5 match_kb_hints.
+    Один проход автомата по каждой форме имени таблицы вместо перебора всех паттернов.
+    """
+    best = None
+    for tf in tl_singulars:
+        last = len(tf) - 1
+        for end, (form, refs) in _KB_AUTOMATON.iter(tf):
+            at_end = end == last
+            exact = at_end and len(form) == len(tf)     # правила 1-3
+            suffix = at_end and len(form) >= 5          # правило 4
+            substr = tf == tl_no_sep and len(form) >= 6 # правило 5
+            if not (exact or suffix or substr):
+                continue
+            for pos, pattern, is_core in refs:
+                if (exact or not is_core) and (best is None or pos < best[0]):
+                    best = (pos, pattern)
+    return best[1] if best else None
+
 
+def _match_kb_linear(tl_no_sep: str, tl_singulars: set):
+    """Первый паттерн KB, подходящий к имени таблицы (линейный перебор правил 1-5)."""
+    for pattern, pat_no_sep, pat_singulars, core_singulars in _KB_INDEX:
         # 1. Точное совпадение (с нормализацией разделителей + числа)
         if pat_no_sep == tl_no_sep:
-            return hints
+            return pattern
         if tl_singulars & pat_singulars:
-            return hints
-
-        # 2. Префикс "jira" в KB: jiraissue → issue ↔ issues
-        if pat_no_sep.startswith("jira"):
-            core = pat_no_sep[4:]
-            core_singulars = _singularize(core)
-            if tl_singulars & core_singulars:
-                return hints
-
-        # 3. Префикс "project" в KB: projectversion → version ↔ versions
-        if pat_no_sep.startswith("project"):
-            core = pat_no_sep[7:]
-            core_singulars = _singularize(core)
-            if tl_singulars & core_singulars:
-                return hints
+            return pattern
+
+        # 2-3. Префикс "jira"/"project" в KB: jiraissue → issue ↔ issues,
+        #      projectversion → version ↔ versions
+        if tl_singulars & core_singulars:
+            return pattern
 
         # 4. Суффиксный матч: dm_jira_components → component
         for pf in pat_singulars:
             if len(pf) >= 5 and any(tf.endswith(pf) for tf in tl_singulars):
-                return hints
+                return pattern
 
         # 5. Подстрока >= 6 символов (избегает ложных матчей)
         for pf in pat_singulars:
             if len(pf) >= 6 and pf in tl_no_sep:
-                return hints
+                return pattern
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _match_kb_pattern(tl_no_sep: str):
+    """Паттерн KB для нормализованного имени таблицы (или None).
+    Кэш сбрасывается в load_knowledge_base: одни и те же таблицы
+    запрашиваются и при обогащении описаний, и при поиске связей.
+    """
+    tl_singulars = _singularize(tl_no_sep)
+    # Пустая форма ("s", "_") в автомат не кладётся — такие имена идут линейным перебором
+    if _KB_AUTOMATON is not None and "" not in tl_singulars:
+        return _match_kb_automaton(tl_no_sep, tl_singulars)
+    return _match_kb_linear(tl_no_sep, tl_singulars)
+
+
+def match_kb_hints(table_name: str, etl_plan: dict = None) -> dict:
+    """Найти подсказки из Knowledge Base для таблицы.
+    Сопоставление учитывает подчёркивания (issue_links ↔ issuelink),
+    множественное число (priorities ↔ priority), префиксы (jiraissue ↔ issues).
+    """
+    tl = table_name.lower()
+    tl_no_sep = tl.replace("_", "").replace("-", "")
+    pattern = _match_kb_pattern(tl_no_sep)
+    if pattern is not None:
+        return _KNOWLEDGE_BASE[pattern]
 
     if etl_plan:
+        tl_singulars = _singularize(tl_no_sep)
         for src_table, plan_info in etl_plan.items():
             src_no_sep = src_table.lower().replace("_", "")
             src_singulars = _singularize(src_no_sep)
@@ -650,9 +1213,12 @@ def match_kb_hints(table_name: str, etl_plan: dict = None) -> dict:
 
 
 def enrich_descriptions_with_kb(descriptions: dict, table_name: str,
-                                columns: list, etl_plan: dict = None) -> dict:
-    """Дополнить GigaChat-описания подсказками из Knowledge Base."""
-    hints = match_kb_hints(table_name, etl_plan)
+                                columns: list, etl_plan: dict = None, hints: dict = None) -> dict:
+    """Дополнить GigaChat-описания подсказками из Knowledge Base.
+    hints — результат match_kb_hints(table_name, etl_plan), если уже посчитан.
+    """
+    if hints is None:
+        hints = match_kb_hints(table_name, etl_plan)
     if not hints:
         return descriptions
 
@@ -686,127 +1252,221 @@ def get_kb_suggested_measures(table_name: str) -> list:
 # Обнаружение связей между таблицами
 # ============================================================
 
+# Подстроки типов колонок, которые могут быть FK
+_FK_TYPE_MARKERS = ("integer", "int", "bigint", "smallint", "serial", "numeric", "decimal", "number")
+
+
+@lru_cache(maxsize=256)
 def _is_likely_fk_type(data_type: str) -> bool:
-    """Тип колонки может быть FK (integer, bigint, numeric)."""
+    """Тип колонки может быть FK (integer, bigint, numeric).
+    Типов в схеме единицы, колонок — тысячи: результат кэшируется по имени типа.
+    """
     dt = data_type.lower()
-    return any(t in dt for t in ["integer", "int", "bigint", "smallint", "serial", "numeric", "decimal", "number"])
+    return any(t in dt for t in _FK_TYPE_MARKERS)
+
+
+def _plural_forms(name: str) -> tuple:
+    """Возможные имена таблицы для сущности: project → project, projects, ..."""
+    forms = (name, name + "s", name + "es")        # project, projects, statuses
+    if name.endswith("y"):
+        forms += (name[:-1] + "ies",)              # priority → priorities
+    return forms
+
 
+class TableIndex:
+    """Индекс имён таблиц для поиска связей.
+    Строится один раз на всю схему, чтобы не перебирать все таблицы
+    для каждой колонки:
+      - names — множество имён (прямые попадания за O(1));
+      - by_rest — часть после префикса → [(префикс, таблица)]: issue_statuses → statuses;
+      - tokens — инвертированный индекс: слово имени (и его ед. число) → таблицы;
+      - суффиксный массив — отсортированные суффиксы имён (>= 5 символов) для поиска
+        по подстроке за O(log N) (строится при первом обращении).
+    Поддерживает `in` как обычное множество.
+    """
+
+    MIN_SUBSTRING = 5
+
+    def __init__(self, tables):
+        self.tables = list(tables)
+        self.names = set(self.tables)
+        self.by_rest = {}
+        self.tokens = {}
+        for t in self.tables:
+            for i, ch in enumerate(t):
+                if ch == "_":
+                    self.by_rest.setdefault(t[i + 1:], []).append((t[:i], t))
+            for tok in t.split("_"):
+                for form in _singularize(tok):       # project_components → component(s)
+                    if form in t:                    # только подстроки имени: не priority ← priorities
+                        self.tokens.setdefault(form, []).append(t)
+        self._suffixes = None      # отсортированные суффиксы имён
+        self._suffix_owner = None  # позиция таблицы в self.tables для каждого суффикса
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.tables)
+
+    def __len__(self):
+        return len(self.tables)
+
+    def containing(self, name):
+        """Таблицы, в имени которых есть подстрока name (len(name) >= MIN_SUBSTRING).
+        Сначала — таблицы, где name целое слово имени: это дешёвый поиск по tokens,
+        и индекс подстрок при таком попадании не строится вовсе.
+        """
+        by_token = self.tokens.get(name)
+        if by_token:
+            return by_token
+        if len(name) < self.MIN_SUBSTRING:
+            return ()
+        if self._suffixes is None:
+            # Подстрока name — это префикс одного из суффиксов: O(L) суффиксов на таблицу
+            # вместо O(L²) подстрок, поиск — бинарный по отсортированному массиву
+            n = self.MIN_SUBSTRING
+            pairs = sorted((t[i:], pos) for pos, t in enumerate(self.tables)
+                           for i in range(len(t) - n + 1))
+            self._suffixes = [suffix for suffix, _ in pairs]
+            self._suffix_owner = [pos for _, pos in pairs]
+
+        owners = set()
+        i = bisect_left(self._suffixes, name)
+        while i < len(self._suffixes) and self._suffixes[i].startswith(name):
+            owners.add(self._suffix_owner[i])
+            i += 1
+        return [self.tables[pos] for pos in sorted(owners)]
+
+
+# Доменные префиксы таблиц: status → issue_statuses, type → issue_types
+_DOMAIN_PREFIXES = frozenset({"issue", "project", "workflow", "notification", "permission",
+                              "custom", "screen"})
+
+_USER_TABLES = ("users", "cwd_user", "app_user")
+
+# Семантический маппинг: имя_колонки → список возможных целевых таблиц (по приоритету)
+_SEMANTIC_MAP = {
+    "assignee":   _USER_TABLES,
+    "reporter":   _USER_TABLES,
+    "author":     _USER_TABLES,
+    "creator":    _USER_TABLES,
+    "owner":      _USER_TABLES,
+    "updated_by": _USER_TABLES,
+    "created_by": _USER_TABLES,
+    "lead":       _USER_TABLES,
+    "manager":    _USER_TABLES,
+    "parent":     (None,),  # self-join
+}
+
+# Колонки, которые точно НЕ FK
+_SKIP_COLS = frozenset({"id", "created_at", "updated_at", "created", "updated",
+                        "deleted_at", "sequence", "pcounter", "votes", "watches",
+                        "timeoriginalestimate", "timeestimate", "timespent",
+                        "story_points", "environment", "description", "summary",
+                        "pkey", "issuenum", "body", "name", "pname", "url",
+                        "avatar", "iconurl", "password", "email", "email_address"})
+
+
+def _table_prefixes(table_name: str) -> frozenset:
+    """Префиксы для поиска связанных таблиц: первая часть имени (issues → issue, issues)
+    плюс доменные префиксы. Считается один раз на таблицу.
+    """
+    first = table_name.split("_")[0]
+    return _DOMAIN_PREFIXES | {first, first.rstrip("s")}
 
-def _find_table_match(name: str, all_tables: set, current_table: str) -> str:
+
+def _find_table_match(name: str, tables_index: TableIndex, current_table: str,
+                      prefixes: frozenset = None) -> str:
     """Найти таблицу по имени с учётом множественного числа и префиксов.
+    prefixes — результат _table_prefixes(current_table), если уже посчитан.
     Возвращает имя таблицы или None.
     """
-    candidates = [
-        name,                  # project → project
-        name + "s",            # project → projects
-        name + "es",           # status → statuses
-    ]
-    if name.endswith("y"):
-        candidates.append(name[:-1] + "ies")  # priority → priorities
+    forms = _plural_forms(name)
     if name.endswith("s"):
-        candidates.append(name[:-1])           # users → user
+        forms += (name[:-1],)                      # users → user
 
-    for c in candidates:
-        if c in all_tables and c != current_table:
+    for c in forms:
+        if c in tables_index.names and c != current_table:
             return c
 
-    # Доменные префиксы: status → issue_statuses, type → issue_types
-    parts = current_table.split("_")
-    prefixes = set()
-    if parts:
-        prefixes.add(parts[0].rstrip("s"))     # issues → issue
-        prefixes.add(parts[0])                 # issues
-    prefixes.update(["issue", "project", "workflow", "notification", "permission", "custom", "screen"])
-
-    for prefix in prefixes:
-        prefix_candidates = [
-            f"{prefix}_{name}",
-            f"{prefix}_{name}s",
-            f"{prefix}_{name}es",
-        ]
-        if name.endswith("y"):
-            prefix_candidates.append(f"{prefix}_{name[:-1]}ies")
-        for c in prefix_candidates:
-            if c in all_tables and c != current_table:
-                return c
-
-    # Подстрока >= 5 символов в имени таблицы
-    if len(name) >= 5:
-        for t in all_tables:
-            if t != current_table and name in t:
+    if prefixes is None:
+        prefixes = _table_prefixes(current_table)
+
+    for form in _plural_forms(name):
+        for prefix, t in tables_index.by_rest.get(form, ()):
+            if prefix in prefixes and t != current_table:
+                return t
+
+    # Слово или подстрока >= 5 символов в имени таблицы
+    if len(name) >= TableIndex.MIN_SUBSTRING:
+        for t in tables_index.containing(name):
+            if t != current_table:
                 return t
 
     return None
 
 
-def detect_implicit_relationships(table_name, columns, all_tables, explicit_fks):
+def _classify_columns(columns, explicit_cols):
+    """Разобрать колонки таблицы за один проход (endswith("_id") — один раз на колонку).
+    Возвращает [(колонка, база)] в исходном порядке, без id и явных FK:
+    база — имя без суффикса _id (project_id → project) или None для прочих колонок.
+    """
+    classified = []
+    for c in columns:
+        name = c["name"]
+        if name == "id" or name in explicit_cols:
+            continue
+        classified.append((c, name[:-3] if name.endswith("_id") else None))
+    return classified
+
+
+def detect_implicit_relationships(table_name, columns, tables_index, explicit_fks, classified=None):
     """
     Найти неявные связи по соглашению об именах.
+    tables_index — TableIndex по всем таблицам схемы (строится один раз в main).
+    classified — результат _classify_columns, если уже посчитан.
     Обрабатывает ДВА паттерна:
       A) Колонки с суффиксом _id: project_id → projects, assignee_id → users
       B) Числовые колонки без _id, чьё имя совпадает с таблицей:
          project (integer) → project/projects, issuetype (bigint) → issuetype/issuetypes
     """
-    explicit_cols = {fk["column"] for fk in explicit_fks}
+    if classified is None:
+        classified = _classify_columns(columns, {fk["column"] for fk in explicit_fks})
     implicit = []
     found_cols = set()
+    prefixes = _table_prefixes(table_name)
 
-    # Семантический маппинг: имя_колонки → список возможных целевых таблиц (по приоритету)
-    SEMANTIC_MAP = {
-        "assignee":   ["users", "cwd_user", "app_user"],
-        "reporter":   ["users", "cwd_user", "app_user"],
-        "author":     ["users", "cwd_user", "app_user"],
-        "creator":    ["users", "cwd_user", "app_user"],
-        "owner":      ["users", "cwd_user", "app_user"],
-        "updated_by": ["users", "cwd_user", "app_user"],
-        "created_by": ["users", "cwd_user", "app_user"],
-        "lead":       ["users", "cwd_user", "app_user"],
-        "manager":    ["users", "cwd_user", "app_user"],
-        "parent":     [None],  # self-join
-    }
-
-    # Колонки, которые точно НЕ FK
-    SKIP_COLS = {"id", "created_at", "updated_at", "created", "updated",
-                 "deleted_at", "sequence", "pcounter", "votes", "watches",
-                 "timeoriginalestimate", "timeestimate", "timespent",
-                 "story_points", "environment", "description", "summary",
-                 "pkey", "issuenum", "body", "name", "pname", "url",
-                 "avatar", "iconurl", "password", "email", "email_address"}
+    # Хелпер: попробовать семантический маппинг
+    def _try_semantic(col_name, base_name, source_tag):
+        targets = _SEMANTIC_MAP.get(base_name)
+        if targets is None:
+            return False
+        for target in targets:
+            if target is None:
+                # self-join
+                implicit.append({"column": col_name, "foreign_table": table_name,
+                                 "foreign_column": "id", "source": source_tag})
+                found_cols.add(col_name)
+                return True
+            if target in tables_index:
+                implicit.append({"column": col_name, "foreign_table": target,
+                                 "foreign_column": "id", "source": source_tag})
+                found_cols.add(col_name)
+                return True
+        return False
 
-    for col in columns:
+    for col, base in classified:
         col_name = col["name"]
-        if col_name in explicit_cols or col_name in found_cols:
-            continue
-        if col_name == "id":
+        if col_name in found_cols:
             continue
 
-        # Хелпер: попробовать семантический маппинг
-        def _try_semantic(base_name, source_tag):
-            if base_name not in SEMANTIC_MAP:
-                return False
-            targets = SEMANTIC_MAP[base_name]
-            for target in targets:
-                if target is None:
-                    # self-join
-                    implicit.append({"column": col_name, "foreign_table": table_name,
-                                     "foreign_column": "id", "source": source_tag})
-                    found_cols.add(col_name)
-                    return True
-                if target in all_tables:
-                    implicit.append({"column": col_name, "foreign_table": target,
-                                     "foreign_column": "id", "source": source_tag})
-                    found_cols.add(col_name)
-                    return True
-            return False
-
         # ── Паттерн A: колонки с суффиксом _id ──
-        if col_name.endswith("_id"):
-            base = col_name[:-3]
-
-            if _try_semantic(base, "implicit"):
+        if base is not None:
+            if _try_semantic(col_name, base, "implicit"):
                 continue
 
-            matched = _find_table_match(base, all_tables, table_name)
+            matched = _find_table_match(base, tables_index, table_name, prefixes)
             if matched:
                 implicit.append({"column": col_name, "foreign_table": matched,
                                  "foreign_column": "id", "source": "implicit"})
@@ -815,16 +1475,16 @@ def detect_implicit_relationships(table_name, columns, all_tables, explicit_fks)
 
         # ── Паттерн B: колонки без _id ──
         # B1: семантический маппинг (работает для любого типа — varchar assignee, etc.)
-        if _try_semantic(col_name, "implicit_semantic"):
+        if _try_semantic(col_name, col_name, "implicit_semantic"):
             continue
 
         # B2: числовые колонки, чьё имя совпадает с таблицей (project, issuetype, etc.)
         if not _is_likely_fk_type(col["data_type"]):
             continue
-        if col_name in SKIP_COLS:
+        if col_name in _SKIP_COLS:
             continue
 
-        matched = _find_table_match(col_name, all_tables, table_name)
+        matched = _find_table_match(col_name, tables_index, table_name, prefixes)
         if matched:
             implicit.append({"column": col_name, "foreign_table": matched,
                              "foreign_column": "id", "source": "implicit_no_id"})
@@ -833,30 +1493,24 @@ def detect_implicit_relationships(table_name, columns, all_tables, explicit_fks)
     return implicit
 
 
-def build_all_relationships(table_name, columns, all_tables, explicit_fks):
+def build_all_relationships(table_name, columns, tables_index, explicit_fks, classified=None):
     """
     Объединить явные FK и неявные связи.
     При множественных ссылках на одну таблицу — генерировать алиасы.
+    classified — результат _classify_columns (пробрасывается в detect_implicit_relationships).
     Возвращает список join-записей:
       [{"column": "assignee_id", "foreign_table": "users", "alias": "users_assignee",
         "foreign_column": "id", "relationship": "many_to_one"}]
     """
-    # Собираем все связи
-    all_rels = []
-    for fk in explicit_fks:
-        all_rels.append({**fk, "source": "explicit"})
-
-    implicit = detect_implicit_relationships(table_name, columns, all_tables, explicit_fks)
-    all_rels.extend(implicit)
+    # Собираем все связи (у явных FK нет ключа "source" — ниже он станет "explicit")
+    implicit = detect_implicit_relationships(table_name, columns, tables_index, explicit_fks, classified)
+    all_rels = [*explicit_fks, *implicit]
 
     if not all_rels:
         return []
 
     # Считаем сколько раз каждая таблица фигурирует как цель
-    target_count = {}
-    for rel in all_rels:
-        t = rel["foreign_table"]
-        target_count[t] = target_count.get(t, 0) + 1
+    target_count = Counter(rel["foreign_table"] for rel in all_rels)
 
     # Генерируем записи с алиасами
     joins = []
@@ -883,34 +1537,47 @@ def build_all_relationships(table_name, columns, all_tables, explicit_fks):
     return joins
 
 
+# Паттерны и таблицы замен для разбора JSON из ответов LLM — компилируются один раз
+_TRAIL_COMMA_OBJ_RE = re.compile(r',\s*}')
+_TRAIL_COMMA_ARR_RE = re.compile(r',\s*]')
+_CONTROL_CHARS_RE = re.compile(r'[\x00-\x1f]+')
+# Для _balance_brackets: строковый литерал целиком (группа пустая) или одна скобка вне строк
+_BRACKET_SCAN_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*(?:"|\\?\Z)|([\[\]{}])', re.DOTALL)
+_CLOSING_BRACKET = {'{': '}', '[': ']'}
+# Типографские кавычки и NBSP (не пробел для JSON) → ASCII; тире и многоточие — только
+# при агрессивной чистке, чтобы не портить текст описаний
+_QUOTE_TABLE = str.maketrans({'\u201c': '"', '\u201d': '"', '\u00ab': '"', '\u00bb': '"',
+                              '\u2018': "'", '\u2019': "'", '\u00a0': ' '})
+_DASH_TABLE = str.maketrans({'\u2014': '-', '\u2013': '-', '\u2026': '...'})
+
+# Починка пропущенных запятых (_fix_missing_commas) — замены применяются по порядку
+_COMMA_FIXES = tuple((re.compile(pattern), repl) for pattern, repl in (
+    # --- Многострочный: "value"\n  "key" → "value",\n  "key" ---
+    (r'(")\s*\n(\s*")', r'\1,\n\2'),
+    (r'(})\s*\n(\s*")', r'\1,\n\2'),
+    (r'(\])\s*\n(\s*")', r'\1,\n\2'),
+    (r'(true|false|null|\d)\s*\n(\s*")', r'\1,\n\2'),
+    (r'(})\s*\n(\s*\{)', r'\1,\n\2'),
+    # --- Однострочный: "value" "key" → "value", "key" ---
+    (r'(") (")', r'\1, \2'),                      # два строковых значения подряд
+    (r'(}) (")', r'\1, \2'),                      # } "key"  →  }, "key"
+    (r'(\]) (")', r'\1, \2'),                     # ] "key"  →  ], "key"
+    (r'(true|false|null)(\s+)(")', r'\1,\2\3'),   # true/false/null  "key"
+    (r'(\d)(\s+)(")', r'\1,\2\3'),                # number  "key"
+    (r'(})\s*(\{)', r'\1, \2'),                   # } {  →  }, {  (массив объектов)
+)) + (
+    # --- Trailing commas ---
+    (_TRAIL_COMMA_OBJ_RE, '}'),
+    (_TRAIL_COMMA_ARR_RE, ']'),
+)
+
+
 def _fix_missing_commas(text):
     """Вставить пропущенные запятые в JSON от GigaChat.
     Обрабатывает как многострочный, так и однострочный JSON.
     """
-    import re
-    # --- Многострочный: "value"\n  "key" → "value",\n  "key" ---
-    text = re.sub(r'(")\s*\n(\s*")', r'\1,\n\2', text)
-    text = re.sub(r'(})\s*\n(\s*")', r'\1,\n\2', text)
-    text = re.sub(r'(\])\s*\n(\s*")', r'\1,\n\2', text)
-    text = re.sub(r'(true|false|null|\d)\s*\n(\s*")', r'\1,\n\2', text)
-    text = re.sub(r'(})\s*\n(\s*\{)', r'\1,\n\2', text)
-
-    # --- Однострочный: "value" "key" → "value", "key" ---
-    # "..." "..."  (два строковых значения подряд без запятой)
-    text = re.sub(r'(") (")', r'\1, \2', text)
-    # } "key"  →  }, "key"
-    text = re.sub(r'(}) (")', r'\1, \2', text)
-    # ] "key"  →  ], "key"
-    text = re.sub(r'(\]) (")', r'\1, \2', text)
-    # true/false/null/number  "key"
-    text = re.sub(r'(true|false|null)(\s+)(")', r'\1,\2\3', text)
-    text = re.sub(r'(\d)(\s+)(")', r'\1,\2\3', text)
-    # } {  →  }, {  (массив объектов)
-    text = re.sub(r'(})\s*(\{)', r'\1, \2', text)
-
-    # --- Trailing commas ---
-    text = re.sub(r',\s*}', '}', text)
-    text = re.sub(r',\s*]', ']', text)
+    for rx, repl in _COMMA_FIXES:
+        text = rx.sub(repl, text)
     return text
 
 
@@ -918,28 +1585,15 @@ def _balance_brackets(text):
     """Добавить недостающие закрывающие скобки в JSON.
     GigaChat часто забывает одну или несколько } в конце ответа.
     """
-    in_string = False
-    escape = False
+    # Строковые литералы (в т.ч. незакрытый в конце) пропускаются регуляркой,
+    # Python-цикл идёт только по самим скобкам
     opens = []
-    match = {'{': '}', '[': ']'}
-    for ch in text:
-        if escape:
-            escape = False
-            continue
-        if ch == '\\' and in_string:
-            escape = True
-            continue
-        if ch == '"' and not escape:
-            in_string = not in_string
-            continue
-        if in_string:
-            continue
+    for ch in _BRACKET_SCAN_RE.findall(text):
         if ch in ('{', '['):
             opens.append(ch)
-        elif ch in ('}', ']'):
-            if opens:
-                opens.pop()
-    closing = ''.join(match[o] for o in reversed(opens))
+        elif ch and opens:
+            opens.pop()
+    closing = ''.join(_CLOSING_BRACKET[o] for o in reversed(opens))
     if closing:
         text = text.rstrip()
         if text.endswith(','):
@@ -954,7 +1608,6 @@ def _parse_json_safe(text):
     пропущенные запятые, несбалансированные скобки.
     """
     import json as _json
-    import re
 
     text = text.strip()
 
@@ -969,17 +1622,21 @@ def _parse_json_safe(text):
                 text = part
                 break
 
-    # Типографские кавычки
-    for old, new in [('\u201c', '"'), ('\u201d', '"'), ('\u00ab', '"'), ('\u00bb', '"'),
-                     ('\u2018', "'"), ('\u2019', "'")]:
-        text = text.replace(old, new)
+    # Типографские кавычки — за один проход
+    text = text.translate(_QUOTE_TABLE)
 
-    # Извлекаем JSON-блок
-    match = re.search(r'\{[\s\S]*\}', text)
-    if match:
-        text = match.group()
+    # Извлекаем JSON-блок: от первой { до последней } (find/rfind вместо жадной регулярки)
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        text = text[start:end + 1]
 
-    # Попытка 1: как есть
+    # Попытка 1: как есть (orjson — быстрый путь для валидного ответа;
+    # то, что он отвергает, например NaN, ещё раз пробует stdlib json)
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
     try:
         return _json.loads(text)
     except _json.JSONDecodeError:
@@ -1000,19 +1657,18 @@ def _parse_json_safe(text):
         pass
 
     # Попытка 4: агрессивная чистка — убираем невалидные символы
-    cleaned = re.sub(r'[\x00-\x1f]+', ' ', balanced)
-    for old, new in [('\u2014', '-'), ('\u2013', '-'), ('\u2026', '...')]:
-        cleaned = cleaned.replace(old, new)
+    cleaned = _CONTROL_CHARS_RE.sub(' ', balanced).translate(_DASH_TABLE)
     try:
         return _json.loads(cleaned)
     except _json.JSONDecodeError as e:
         raise e
 
 
-def suggest_joins_via_llm(llm, table_name, columns, detected_joins, all_tables):
+def suggest_joins_via_llm(llm, table_name, columns, detected_joins, all_tables, fk_candidates=None):
     """
     Попросить GigaChat дать осмысленные описания для джойнов
     и предложить дополнительные связи, которые не были обнаружены автоматически.
+    fk_candidates — имена колонок *_id из _classify_columns, если уже посчитаны.
     """
     if not detected_joins and not columns:
         return {}
@@ -1025,10 +1681,9 @@ def suggest_joins_via_llm(llm, table_name, columns, detected_joins, all_tables):
 
     # Колонки с _id которые не попали в detected
     detected_cols = {j["column"] for j in detected_joins}
-    unmatched_id_cols = [
-        c["name"] for c in columns
-        if c["name"].endswith("_id") and c["name"] != "id" and c["name"] not in detected_cols
-    ]
+    if fk_candidates is None:
+        fk_candidates = [c["name"] for c in columns if c["name"].endswith("_id")]
+    unmatched_id_cols = [name for name in fk_candidates if name not in detected_cols]
 
     unmatched_text = ""
     if unmatched_id_cols:
@@ -1053,12 +1708,53 @@ def suggest_joins_via_llm(llm, table_name, columns, detected_joins, all_tables):
 # Генерация описаний через GigaChat
 # ============================================================
 
+_LLM_CACHE_DIR = None  # Каталог дискового кэша ответов LLM (gigachat.response_cache_dir), None — выключен
+
+
+def _llm_cache_file(llm, prompt):
+    """Файл кэша для ответа на prompt: ключ — BLAKE2b от модели и текста промпта."""
+    import hashlib
+    model = getattr(llm, "model", None) or ""
+    key = hashlib.blake2b(f"{model}\0{prompt}".encode("utf-8"), digest_size=16).hexdigest()
+    return _LLM_CACHE_DIR / f"{key}.txt"
+
+
+def _store_llm_response(cache_file, content):
+    """Сохранить текст ответа в кэш. Ответ, из которого не разбирается JSON, не сохраняется:
+    повторная попытка (batch_describe, перезапуск) должна снова уйти в LLM.
+    """
+    try:
+        _parse_json_safe(content)
+    except Exception:
+        return
+    tmp = cache_file.with_name(f"{cache_file.name}.{threading.get_ident()}.tmp")
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_text(content, encoding="utf-8")
+        os.replace(tmp, cache_file)  # атомарно: параллельные потоки не увидят половину файла
+    except OSError:
+        pass
+
+
 def _llm_invoke_with_retry(llm, prompt, max_retries=3):
-    """Вызов LLM с retry при rate-limit (429) и таймаутах."""
+    """Вызов LLM с retry при rate-limit (429) и таймаутах.
+    С включённым кэшем (_LLM_CACHE_DIR) тот же промпт к той же модели
+    при повторном запуске читается с диска, без запроса.
+    """
     import time as _time
+    cache_file = _llm_cache_file(llm, prompt) if _LLM_CACHE_DIR is not None else None
+    if cache_file is not None:
+        try:
+            content = cache_file.read_text(encoding="utf-8")
+        except OSError:
+            pass
+        else:
+            from langchain_core.messages import AIMessage
+            return AIMessage(content=content)
+
     for attempt in range(max_retries):
         try:
-            return llm.invoke(prompt)
+            response = llm.invoke(prompt)
         except Exception as e:
             err_str = str(e)
             if "429" in err_str or "Too Many Requests" in err_str or "timeout" in err_str.lower():
@@ -1067,6 +1763,10 @@ def _llm_invoke_with_retry(llm, prompt, max_retries=3):
                 _time.sleep(wait)
             else:
                 raise
+        else:
+            if cache_file is not None:
+                _store_llm_response(cache_file, response.content)
+            return response
     raise RuntimeError(f"LLM не ответил после {max_retries} попыток")
 
 
@@ -1080,8 +1780,8 @@ def _analyze_sample_data(sample_columns, sample_rows, columns):
     analysis = {}
     col_types = {c["name"]: c["data_type"] for c in columns}
 
-    for idx, col_name in enumerate(sample_columns):
-        values = [row[idx] for row in sample_rows]
+    # Строки → колонки одним zip (транспонирование в C), дальше работаем по колонкам
+    for col_name, values in zip(sample_columns, zip(*sample_rows)):
         non_null = [v for v in values if v is not None]
         null_count = len(values) - len(non_null)
 
@@ -1092,11 +1792,7 @@ def _analyze_sample_data(sample_columns, sample_rows, columns):
             analysis[col_name] = info
             continue
 
-        unique = set()
-        for v in non_null:
-            s = str(v).strip()
-            if len(s) <= 100:
-                unique.add(s)
+        unique = {s for s in map(str.strip, map(str, non_null)) if len(s) <= 100}
 
         if len(unique) <= 10 and col_types.get(col_name, "") in (
             "character varying", "text", "varchar", "USER-DEFINED"
@@ -1140,13 +1836,13 @@ def generate_descriptions(llm, table_name, columns, fks, sample_columns,
     # Примеры строк (компактно)
     sample_text = ""
     if sample_rows:
-        sample_text = "\nПримеры строк:\n"
+        sample_lines = ["\nПримеры строк:"]
         for row in sample_rows[:3]:
-            parts = []
-            for col, val in zip(sample_columns, row):
-                val_str = str(val)[:50] if val is not None else "NULL"
-                parts.append(f"{col}={val_str}")
-            sample_text += "  " + ", ".join(parts[:10]) + "\n"
+            sample_lines.append("  " + ", ".join(
+                f"{col}={str(val)[:50] if val is not None else 'NULL'}"
+                for col, val in zip(sample_columns[:10], row[:10])
+            ))
+        sample_text = "\n".join(sample_lines) + "\n"
 
     # FK-контекст
     fk_text = ""
@@ -1222,21 +1918,100 @@ def generate_descriptions(llm, table_name, columns, fks, sample_columns,
     return result
 
 
+# Пакетные описания: в один промпт идут только «узкие» таблицы — иначе ответ
+# не помещается в лимит генерации и обрывается посреди JSON
+_BATCH_MAX_COLUMNS = 15
+
+
+def _describe_batch_prompt(items):
+    """Промпт для описания нескольких таблиц одним запросом (компактный формат колонок)."""
+    blocks = []
+    for item in items:
+        analysis = _analyze_sample_data(item.get("sample_cols"), item.get("sample_rows"),
+                                        item["columns"])
+        col_hints = []
+        for c in item["columns"]:
+            hint = analysis.get(c["name"], {}).get("hint", "")
+            col_hints.append(f"{c['name']}({c['data_type']}){': ' + hint if hint else ''}")
+        block = f"Таблица {item['name']} ({item.get('row_count', 0)} строк). Колонки: {'; '.join(col_hints)}"
+        fks = item.get("fks") or []
+        if fks:
+            block += "\nВнешние ключи: " + ", ".join(
+                f"{f['column']} → {f['foreign_table']}.{f['foreign_column']}" for f in fks)
+        etl = item.get("etl_context") or {}
+        if etl.get("process_description"):
+            block += f"\nETL-контекст: {etl['process_description']}"
+        blocks.append(block)
+    tables_text = "\n\n".join(blocks)
+
+    return f"""Опиши на русском каждую из таблиц ниже.
+
+{tables_text}
+
+Для каждой таблицы дай table_title (2-3 слова) и table_description (1-2 предложения),
+для каждой колонки — title (1-2 слова) и description (кратко, с примерами значений).
+Для колонок-перечислений перечисли допустимые значения.
+
+Ответ строго JSON, ключи — имена таблиц:
+{{"tables": {{"table_name": {{"table_title": "...", "table_description": "...", "columns": {{"col": {{"title": "...", "description": "..."}}}}}}}}}}"""
+
+
+def batch_describe(llm, items, batch_size=5, concurrency=1, max_attempts=2):
+    """Описания нескольких таблиц — по одному запросу к GigaChat на batch_size таблиц
+    вместо запроса на каждую: меньше round-trip'ов и повторного prefill общей инструкции.
+    items — dict с ключами name, columns и (опционально) fks, sample_cols, sample_rows,
+    row_count, etl_context — те же данные, что у generate_descriptions.
+    Возвращает dict: имя таблицы → описания в формате generate_descriptions.
+    Таблиц, которых нет в ответе (обрыв, невалидный JSON), в результате нет —
+    их вызывающий описывает по одной через generate_descriptions.
+    """
+    chunks = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+    def describe_chunk(chunk):
+        prompt = _describe_batch_prompt(chunk)
+        names = [item["name"] for item in chunk]
+        for attempt in range(max_attempts):
+            try:
+                response = _llm_invoke_with_retry(llm, prompt)
+                parsed = _parse_json_safe(response.content)
+            except Exception as e:
+                if attempt == max_attempts - 1:
+                    print(f"  ⚠️ GigaChat не смог описать пакет ({', '.join(names)}): {e}")
+                continue
+            described = parsed.get("tables", parsed) if isinstance(parsed, dict) else {}
+            return {name: described[name] for name in names
+                    if isinstance(described.get(name), dict) and described[name].get("columns")}
+        return {}
+
+    result = {}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+        for part in ex.map(describe_chunk, chunks):
+            result.update(part)
+    return result
+
+
 # ============================================================
 # Маппинг типов PostgreSQL → Cube.js
 # ============================================================
 
-def pg_type_to_cube(pg_type, column_name):
-    """Сопоставить тип PostgreSQL с типом Cube.js"""
+# Подстроки типов — одна регулярка вместо перебора списка (integer/bigint/smallint ⊃ int)
+_TIME_TYPE_RE = re.compile(r'timestamp|date|time')
+_NUMBER_TYPE_RE = re.compile(r'int|serial|numeric|decimal|real|double|float')
+
+
+@lru_cache(maxsize=256)
+def pg_type_to_cube(pg_type):
+    """Сопоставить тип PostgreSQL с типом Cube.js.
+    Различных типов в схеме обычно пара десятков — результат кэшируется.
+    """
     pg_type = pg_type.lower()
     
     # Время
-    if any(t in pg_type for t in ["timestamp", "date", "time"]):
+    if _TIME_TYPE_RE.search(pg_type):
         return "time"
     
     # Числа
-    if any(t in pg_type for t in ["integer", "int", "bigint", "smallint", "serial",
-                                    "numeric", "decimal", "real", "double", "float"]):
+    if _NUMBER_TYPE_RE.search(pg_type):
         return "number"
     
     # Булевы
@@ -1308,38 +2083,9 @@ def generate_cube_yaml(table_name, columns, enriched_joins, pk, descriptions,
     if joins:
         cube["joins"] = joins
     
-    # --- Dimensions ---
+    # --- Dimensions и Measures — за один проход по колонкам ---
     dimensions = []
     col_descs = desc.get("columns", {})
-    
-    for c in columns:
-        col_name = c["name"]
-        cube_type = pg_type_to_cube(c["data_type"], col_name)
-        
-        # Пропускаем FK-колонки (они уходят через join)
-        if col_name in join_columns and col_name != pk:
-            continue
-        
-        dim = {
-            "name": col_name,
-            "sql": col_name,
-            "type": cube_type,
-        }
-        
-        if col_name == pk:
-            dim["primary_key"] = True
-        
-        col_desc = col_descs.get(col_name, {})
-        if col_desc.get("title"):
-            dim["title"] = col_desc["title"]
-        if col_desc.get("description"):
-            dim["description"] = col_desc["description"]
-        
-        dimensions.append(dim)
-    
-    cube["dimensions"] = dimensions
-    
-    # --- Measures ---
     measures = [
         {
             "name": "count",
@@ -1349,13 +2095,32 @@ def generate_cube_yaml(table_name, columns, enriched_joins, pk, descriptions,
         }
     ]
     
-    # Добавляем sum/avg для числовых колонок (не ID и не FK)
     for c in columns:
         col_name = c["name"]
-        if col_name.endswith("_id") or col_name == pk:
-            continue
-        if pg_type_to_cube(c["data_type"], col_name) == "number":
-            col_title = col_descs.get(col_name, {}).get("title", col_name)
+        cube_type = pg_type_to_cube(c["data_type"])
+        col_desc = col_descs.get(col_name, {})
+        
+        # Пропускаем FK-колонки (они уходят через join)
+        if not (col_name in join_columns and col_name != pk):
+            dim = {
+                "name": col_name,
+                "sql": col_name,
+                "type": cube_type,
+            }
+            
+            if col_name == pk:
+                dim["primary_key"] = True
+            
+            if col_desc.get("title"):
+                dim["title"] = col_desc["title"]
+            if col_desc.get("description"):
+                dim["description"] = col_desc["description"]
+            
+            dimensions.append(dim)
+        
+        # Добавляем sum/avg для числовых колонок (не ID и не FK)
+        if cube_type == "number" and not col_name.endswith("_id") and col_name != pk:
+            col_title = col_desc.get("title", col_name)
             measures.append({
                 "name": f"total_{col_name}",
                 "sql": col_name,
@@ -1371,6 +2136,8 @@ def generate_cube_yaml(table_name, columns, enriched_joins, pk, descriptions,
                 "description": f"Среднее значение поля {col_name}"
             })
     
+    cube["dimensions"] = dimensions
+    
     # Дополнительные меры из Knowledge Base
     jira_measures = get_kb_suggested_measures(table_name)
     existing_names = {m["name"] for m in measures}
@@ -1387,73 +2154,74 @@ def generate_cube_yaml(table_name, columns, enriched_joins, pk, descriptions,
 # Генерация semantic-конфигов (glossary, examples)
 # ============================================================
 
-def generate_glossary(all_tables_info):
-    """Сгенерировать базовый glossary.yml"""
-    glossary = {}
+def _glossary_terms(info):
+    """Термины glossary для одной таблицы: сущность и её count"""
+    table = info["table_name"]
+    desc = info["descriptions"]
+    title = desc.get("table_title", table)
+    title_lower = title.lower()
     
-    for info in all_tables_info:
-        table = info["table_name"]
-        desc = info["descriptions"]
-        cube_name = table
-        
-        # Термин для таблицы
-        title = desc.get("table_title", table)
-        glossary[table] = {
-            "aliases": [title.lower(), table, table.replace("_", " ")],
-            "semantic_type": "entity",
-            "fields": [f"{cube_name}.id"],
-            "filter_operator": "equals",
-            "description": desc.get("table_description", "")
-        }
-        
-        # Термин count для таблицы
-        glossary[f"{table}_count"] = {
-            "aliases": [
-                f"количество {title.lower()}",
-                f"сколько {title.lower()}",
-            ],
-            "semantic_type": "metric",
-            "measures": [f"{cube_name}.count"],
-            "description": f"Количество записей {title}"
-        }
+    # Термин для таблицы
+    yield table, {
+        "aliases": [title_lower, table, table.replace("_", " ")],
+        "semantic_type": "entity",
+        "fields": [f"{table}.id"],
+        "filter_operator": "equals",
+        "description": desc.get("table_description", "")
+    }
     
-    return glossary
+    # Термин count для таблицы
+    yield f"{table}_count", {
+        "aliases": [
+            f"количество {title_lower}",
+            f"сколько {title_lower}",
+        ],
+        "semantic_type": "metric",
+        "measures": [f"{table}.count"],
+        "description": f"Количество записей {title}"
+    }
+
+
+def generate_glossary(all_tables_info):
+    """Сгенерировать базовый glossary.yml"""
+    return dict(term for info in all_tables_info for term in _glossary_terms(info))
 
 
 def generate_examples(all_tables_info):
     """Сгенерировать базовый examples.yml"""
     examples = []
+    add = examples.append
     
     for info in all_tables_info:
         table = info["table_name"]
-        desc = info["descriptions"]
-        cube_name = table
-        title = desc.get("table_title", table)
+        title_lower = info["descriptions"].get("table_title", table).lower()
+        count_measure = [f"{table}.count"]
         
         # Пример: "сколько <сущностей>"
-        examples.append({
-            "question": f"сколько {title.lower()}",
+        add({
+            "question": f"сколько {title_lower}",
             "intent": "analytics",
             "query": {
-                "measures": [f"{cube_name}.count"],
+                "measures": count_measure,
                 "limit": 100
             },
             "tags": ["count", table]
         })
         
-        # Пример: "список <сущностей>"
-        dims = []
-        for c in info["columns"][:5]:
-            if c["name"] != "id" and not c["name"].endswith("_id"):
-                dims.append(f"{cube_name}.{c['name']}")
+        # Пример: "список <сущностей>" — до 4 не-ID колонок из первых 5
+        dims = list(islice(
+            (f"{table}.{c['name']}" for c in info["columns"][:5]
+             if c["name"] != "id" and not c["name"].endswith("_id")),
+            4
+        ))
         
         if dims:
-            examples.append({
-                "question": f"список {title.lower()}",
+            add({
+                "question": f"список {title_lower}",
                 "intent": "analytics",
                 "query": {
-                    "measures": [f"{cube_name}.count"],
-                    "dimensions": dims[:4],
+                    "measures": list(count_measure),
+                    "dimensions": dims,
                     "limit": 100
                 },
                 "tags": ["list", table]
@@ -1549,7 +2317,7 @@ def _format_etl_summary(etl_entry: dict, parsed_plan: dict) -> str:
 # ============================================================
 
 def enrich_models_with_etl(model_dir: str, etl_plan: dict, llm=None,
-                           data_source=None, kb_path: str = None) -> dict:
+                           data_source=None, kb_path: str = None, concurrency: int = 1) -> dict:
     """Обогатить уже сгенерированные Cube YAML-модели данными из ETL plan.
 
     Параметры:
@@ -1558,6 +2326,7 @@ def enrich_models_with_etl(model_dir: str, etl_plan: dict, llm=None,
       llm         — GigaChat (опционально, для переописания колонок)
       data_source — источник данных (опционально, для sample data)
       kb_path     — путь к KB (опционально)
+      concurrency — сколько запросов к GigaChat выполнять одновременно
 
     Возвращает: {updated: [...], skipped: [...], errors: [...]}
     """
@@ -1582,11 +2351,12 @@ def enrich_models_with_etl(model_dir: str, etl_plan: dict, llm=None,
 
     results = {"updated": [], "skipped": [], "errors": []}
 
+    matched = []  # (yml_file, model, cube, cube_name, matched_key, matched_data)
     for yml_file in yml_files:
         cube_name = yml_file.stem
         try:
-            with open(yml_file, 'r', encoding='utf-8') as f:
-                model = yaml.safe_load(f)
+            with open(yml_file, 'rb') as f:
+                model = yaml.load(f, Loader=_YamlLoader)
         except Exception as e:
             results["errors"].append(f"{cube_name}: ошибка чтения — {e}")
             continue
@@ -1636,7 +2406,40 @@ def enrich_models_with_etl(model_dir: str, etl_plan: dict, llm=None,
         if not matched_data:
             results["skipped"].append(cube_name)
             continue
+        matched.append((yml_file, model, cube, cube_name, matched_key, matched_data))
+
+    # GigaChat с ETL-контекстом: данные источника читаются последовательно (одно соединение),
+    # сами запросы к GigaChat — параллельно, они упираются в сеть
+    llm_results = {}  # cube_name → описания от GigaChat или исключение
+    if llm and data_source:
+        llm_inputs = {}
+        for _, _, _, cube_name, _, matched_data in matched:
+            try:
+                columns = data_source.get_columns(cube_name)
+                fks = data_source.get_foreign_keys(cube_name)
+                row_count = data_source.get_row_count(cube_name)
+                scols, srows = data_source.get_sample_data(cube_name, 10)
+                llm_inputs[cube_name] = (columns, fks, scols, srows, row_count, matched_data["entry"])
+            except Exception as e:
+                llm_results[cube_name] = e
+
+        def describe(cube_name):
+            columns, fks, scols, srows, row_count, entry = llm_inputs[cube_name]
+            try:
+                return generate_descriptions(
+                    llm, cube_name, columns, fks, scols, srows, row_count,
+                    etl_context=entry
+                )
+            except Exception as e:
+                return e
+
+        if llm_inputs:
+            print(f"🤖 GigaChat: описания {len(llm_inputs)} моделей "
+                  f"(до {concurrency} запросов одновременно)...\n")
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+                llm_results.update(zip(llm_inputs, ex.map(describe, llm_inputs)))
 
+    for yml_file, model, cube, cube_name, matched_key, matched_data in matched:
         print(f"🔗 {cube_name} ← ETL: {matched_key}")
 
         entry = matched_data["entry"]
@@ -1660,17 +2463,11 @@ def enrich_models_with_etl(model_dir: str, etl_plan: dict, llm=None,
                 changes.append(f"ETL-колонки не в модели: {', '.join(sorted(new_cols_in_etl))}")
 
         # 3. Если есть LLM + data_source — переописываем колонки с ETL-контекстом
-        if llm and data_source:
+        if cube_name in llm_results:
             try:
-                columns = data_source.get_columns(cube_name)
-                fks = data_source.get_foreign_keys(cube_name)
-                row_count = data_source.get_row_count(cube_name)
-                scols, srows = data_source.get_sample_data(cube_name, 10)
-
-                new_desc = generate_descriptions(
-                    llm, cube_name, columns, fks, scols, srows, row_count,
-                    etl_context=entry
-                )
+                new_desc = llm_results[cube_name]
+                if isinstance(new_desc, Exception):
+                    raise new_desc
 
                 # Обновляем title/description если GigaChat дал лучше
                 if new_desc.get("table_title") and len(new_desc["table_title"]) > len(cube.get("title", "")):
@@ -1723,8 +2520,7 @@ def enrich_models_with_etl(model_dir: str, etl_plan: dict, llm=None,
 
         if changes:
             model["cubes"][0] = cube
-            with open(yml_file, 'w', encoding='utf-8') as f:
-                yaml.dump(model, f, allow_unicode=True, default_flow_style=False, sort_keys=False)
+            _write_yaml(yml_file, model)
             results["updated"].append(f"{cube_name}: {', '.join(changes)}")
             print(f"   ✅ {', '.join(changes)}")
         else:
@@ -1744,6 +2540,25 @@ def enrich_models_with_etl(model_dir: str, etl_plan: dict, llm=None,
 # MAIN
 # ============================================================
 
+def _write_yaml(path, data):
+    """Записать YAML (через libyaml CSafeDumper, если доступен)"""
+    with open(path, 'w', encoding='utf-8', buffering=1 << 16) as f:
+        yaml.dump(data, f, Dumper=_YamlDumper, allow_unicode=True,
+                  default_flow_style=False, sort_keys=False)
+
+
+def _match_etl_context(table, etl_plan):
+    """Найти запись ETL plan для таблицы (по имени без подчёркиваний).
+    Возвращает (имя source-таблицы, её данные) или (None, None).
+    """
+    table_norm = table.lower().replace("_", "")
+    for src_name, plan_info in (etl_plan or {}).items():
+        src_norm = src_name.lower().replace("_", "")
+        if src_norm == table_norm or table_norm in src_norm or src_norm in table_norm:
+            return src_name, plan_info
+    return None, None
+
+
 def main():
     parser = argparse.ArgumentParser(description="Загрузчик данных в Cube")
     parser.add_argument("--source", choices=["postgresql", "greenplum", "hive", "duckdb", "cube"],
@@ -1758,10 +2573,19 @@ def main():
                         help="При --enrich-etl переописывать колонки через GigaChat + sample data")
     parser.add_argument("--model-dir", metavar="DIR",
                         help="Папка с моделями (для --enrich-etl, по умолчанию из config.yml)")
+    parser.add_argument("--exact-counts", action="store_true",
+                        help="Точный COUNT(*) по каждой таблице вместо оценки из каталога БД")
+    parser.add_argument("--bootstrap", action="store_true",
+                        help="Доустановить недостающие пакеты через pip перед запуском")
     args = parser.parse_args()
 
     # 1. Загрузить конфиг
     config = load_config()
+    if args.exact_counts:
+        config.setdefault("database", {})["exact_counts"] = True
+    if _YamlLoader is yaml.SafeLoader:
+        print("⚠️  PyYAML собран без libyaml: модели Cube читаются и пишутся на чистом Python "
+              "(в 5-10 раз медленнее). Переустановите PyYAML с поддержкой libyaml.")
 
     # ── Режим: обогащение существующих моделей через ETL plan ──
     if args.enrich_etl:
@@ -1800,7 +2624,8 @@ def main():
             etl_plan=etl_plan,
             llm=llm,
             data_source=data_source,
-            kb_path=kb_path
+            kb_path=kb_path,
+            concurrency=config["gigachat"].get("concurrency", 4),
         )
 
         if data_source:
@@ -1860,22 +2685,74 @@ def main():
     model_path.mkdir(parents=True, exist_ok=True)
     
     all_tables_set = set(tables)
+    tables_index = TableIndex(tables)  # для поиска связей по именам — один раз на схему
     all_tables_info = []
+
+    # Читаем структуру всех таблиц заранее (пакетно и параллельно)
+    print("🔄 Чтение структуры таблиц...")
+    table_meta = introspect_tables(source, tables)
+    print()
+
+    # Связи (FK + implicit по именам) и ETL-контекст — без сети, до запросов к GigaChat
+    relationships = {}
+    fk_candidates = {}  # таблица → колонки *_id без явного FK
+    etl_matches = {}  # таблица → (source-таблица ETL plan, её данные) или (None, None)
+    for table in tables:
+        meta = table_meta[table]
+        classified = _classify_columns(meta["columns"], {fk["column"] for fk in meta["fks"]})
+        fk_candidates[table] = [c["name"] for c, base in classified if base is not None]
+        relationships[table] = build_all_relationships(table, meta["columns"], tables_index,
+                                                       meta["fks"], classified)
+        etl_matches[table] = _match_etl_context(table, etl_plan)
+
+    concurrency = config["gigachat"].get("concurrency", 4)
+
+    # Узкие таблицы описываем пакетами — один запрос на describe_batch_size таблиц;
+    # что не вернулось из пакета, ниже описывается по одной
+    batch_size = config["gigachat"].get("describe_batch_size", 5)
+    batched_descriptions = {}
+    if batch_size > 1:
+        narrow = [{"name": t, **table_meta[t], "etl_context": etl_matches[t][1]}
+                  for t in tables if len(table_meta[t]["columns"]) <= _BATCH_MAX_COLUMNS]
+        if len(narrow) > 1:
+            print(f"🤖 GigaChat: пакетные описания {len(narrow)} таблиц (по {batch_size} в запросе)...")
+            batched_descriptions = batch_describe(llm, narrow, batch_size, concurrency)
+
+    # Запросы к GigaChat (описание связей + описания таблицы) — параллельно:
+    # вызовы упираются в сеть, а не в CPU, и время падает с N·RTT до N/потоков·RTT
+    def ask_llm(table):
+        meta = table_meta[table]
+        join_suggestions = {}
+        if relationships[table]:
+            join_suggestions = suggest_joins_via_llm(llm, table, meta["columns"], relationships[table],
+                                                     all_tables_set, fk_candidates[table])
+        descriptions = batched_descriptions.get(table)
+        if descriptions is None:
+            descriptions = generate_descriptions(
+                llm, table, meta["columns"], meta["fks"], meta["sample_cols"], meta["sample_rows"],
+                meta["row_count"], etl_context=etl_matches[table][1]
+            )
+        return join_suggestions, descriptions
+
+    print(f"🤖 GigaChat: описания связей, таблиц и колонок "
+          f"({len(tables)} таблиц, до {concurrency} запросов одновременно)...")
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        llm_results = dict(zip(tables, ex.map(ask_llm, tables)))
+    print()
     
     for i, table in enumerate(tables, 1):
         print(f"[{i}/{len(tables)}] Обработка таблицы: {table}")
         
-        # Читаем структуру через унифицированный интерфейс
-        columns = source.get_columns(table)
-        fks = source.get_foreign_keys(table)
-        pk = source.get_primary_key(table)
-        row_count = source.get_row_count(table)
-        sample_cols, sample_rows = source.get_sample_data(table, 5)
+        meta = table_meta[table]
+        columns = meta["columns"]
+        fks = meta["fks"]
+        pk = meta["pk"]
+        row_count = meta["row_count"]
+        join_suggestions, descriptions = llm_results[table]
         
         print(f"   Колонок: {len(columns)}, FK: {len(fks)}, Строк: {row_count}")
         
-        # Обнаруживаем все связи (FK + implicit по именам)
-        enriched_joins = build_all_relationships(table, columns, all_tables_set, fks)
+        enriched_joins = relationships[table]
         implicit_count = sum(1 for j in enriched_joins if j.get("source") == "implicit")
         if enriched_joins:
             print(f"   🔗 Связей: {len(enriched_joins)} (FK: {len(fks)}, по именам: {implicit_count})")
@@ -1883,12 +2760,8 @@ def main():
                 src = "FK" if j["source"] == "explicit" else "→"
                 print(f"      {src} {j['column']} → {j['foreign_table']} (as {j['alias']})")
         
-        # Просим GigaChat описать связи (если они есть)
+        # Обогащаем joins описаниями от GigaChat (если связи есть)
         if enriched_joins:
-            print(f"   🤖 GigaChat: описание связей...")
-            join_suggestions = suggest_joins_via_llm(llm, table, columns, enriched_joins, all_tables_set)
-            
-            # Обогащаем joins описаниями от LLM
             llm_joins_map = {}
             for lj in join_suggestions.get("joins", []):
                 key = lj.get("column", "")
@@ -1921,29 +2794,16 @@ def main():
                         })
                         print(f"      ✨ LLM предложил: {extra['column']} → {extra_table}")
         
-        # ETL-контекст для текущей таблицы
-        etl_context = None
-        if etl_plan:
-            for src_name, plan_info in etl_plan.items():
-                src_norm = src_name.lower().replace("_", "")
-                table_norm = table.lower().replace("_", "")
-                if src_norm == table_norm or table_norm in src_norm or src_norm in table_norm:
-                    etl_context = plan_info
-                    print(f"   📋 ETL plan: сопоставлена с {src_name}")
-                    break
-
-        # Генерируем описания через GigaChat
-        print(f"   🤖 GigaChat: описания таблицы и колонок...")
-        descriptions = generate_descriptions(
-            llm, table, columns, fks, sample_cols, sample_rows, row_count,
-            etl_context=etl_context
-        )
+        etl_src_name, etl_context = etl_matches[table]
+        if etl_context:
+            print(f"   📋 ETL plan: сопоставлена с {etl_src_name}")
 
         # Обогащаем описания из Knowledge Base
         kb_hints = match_kb_hints(table, etl_plan)
         if kb_hints:
             print(f"   📚 KB: {kb_hints.get('title', 'match found')}")
-            descriptions = enrich_descriptions_with_kb(descriptions, table, columns, etl_plan)
+            descriptions = enrich_descriptions_with_kb(descriptions, table, columns, etl_plan,
+                                                       hints=kb_hints)
             if not descriptions.get("table_description") or len(descriptions["table_description"]) < 10:
                 descriptions["table_description"] = kb_hints.get("description", descriptions.get("table_description", ""))
             if not descriptions.get("table_title") or descriptions["table_title"] == table:
@@ -1958,8 +2818,7 @@ def main():
         
         # Сохраняем
         yaml_path = model_path / f"{table}.yml"
-        with open(yaml_path, 'w', encoding='utf-8') as f:
-            yaml.dump(cube_yaml, f, allow_unicode=True, default_flow_style=False, sort_keys=False)
+        _write_yaml(yaml_path, cube_yaml)
         
         print(f"   💾 Сохранено: {yaml_path}")
         
@@ -1978,13 +2837,11 @@ def main():
     
     print("📝 Генерация glossary.yml...")
     glossary = generate_glossary(all_tables_info)
-    with open(config_path / "glossary.yml", 'w', encoding='utf-8') as f:
-        yaml.dump(glossary, f, allow_unicode=True, default_flow_style=False, sort_keys=False)
+    _write_yaml(config_path / "glossary.yml", glossary)
     
     print("📝 Генерация examples.yml...")
     examples = generate_examples(all_tables_info)
-    with open(config_path / "examples.yml", 'w', encoding='utf-8') as f:
-        yaml.dump(examples, f, allow_unicode=True, default_flow_style=False, sort_keys=False)
+    _write_yaml(config_path / "examples.yml", examples)
     
     print("📝 Генерация semantic_layer.yml...")
     layer_config = {
@@ -2006,8 +2863,7 @@ def main():
             "max_limit": 10000
         }
     }
-    with open(config_path / "semantic_layer.yml", 'w', encoding='utf-8') as f:
-        yaml.dump(layer_config, f, allow_unicode=True, default_flow_style=False, sort_keys=False)
+    _write_yaml(config_path / "semantic_layer.yml", layer_config)
     
     source.close()
     
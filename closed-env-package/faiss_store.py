@@ -0,0 +1,92 @@
+"""
+Формат FAISS-индекса на диске: запись (02_build_faiss.py) и загрузка без pickle
+(03_agent.ipynb, validate.py).
+
+    <faiss.index_path>/
+        index.faiss      — faiss.write_index, векторы в порядке members.json
+        index_meta.json  — заголовок: число и размерность векторов, тип индекса, ids мемберов
+        members.json     — метаданные Cube-мемберов (они же metadata документов при поиске)
+"""
+
+import json
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+INDEX_FILE = "index.faiss"
+META_FILE = "index_meta.json"
+MEMBERS_FILE = "members.json"
+
+
+def _dumps(data, indent=False) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(data, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
+
+
+def _loads(path: Path):
+    data = path.read_bytes()
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def save_index(index, members_data, index_path):
+    """Записать индекс, заголовок и members.json.
+    members_data — список dict в порядке добавления векторов в индекс.
+    """
+    import faiss
+
+    index_path = Path(index_path)
+    index_path.mkdir(parents=True, exist_ok=True)
+
+    faiss.write_index(index, str(index_path / INDEX_FILE))
+    meta = {
+        "count": index.ntotal,
+        "dim": index.d,
+        "index_type": type(index).__name__,
+        "metric": "inner_product",
+        "ids": [m["name"] for m in members_data],
+    }
+    (index_path / META_FILE).write_bytes(_dumps(meta))
+    with open(index_path / MEMBERS_FILE, 'wb', buffering=1 << 20) as f:
+        f.write(_dumps(members_data, indent=True))
+
+
+def load_store(index_path, embeddings, nprobe=None):
+    """Загрузить индекс как LangChain FAISS-хранилище.
+    index.faiss читается через mmap (страницы подгружаются по требованию),
+    docstore собирается из members.json — без index.pkl и allow_dangerous_deserialization.
+    nprobe — число просматриваемых кластеров для IVF-индексов (faiss.nprobe) без пересборки;
+    у остальных типов игнорируется.
+    Возвращает (store, members).
+    """
+    import faiss
+    from langchain_core.documents import Document
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.vectorstores.utils import DistanceStrategy
+
+    index_path = Path(index_path)
+    if not (index_path / META_FILE).exists():
+        raise FileNotFoundError(f"{index_path / META_FILE} не найден — пересоберите индекс: python 02_build_faiss.py")
+
+    meta = _loads(index_path / META_FILE)
+    members = _loads(index_path / MEMBERS_FILE)
+    index = faiss.read_index(str(index_path / INDEX_FILE),
+                             faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    if index.ntotal != meta["count"] or meta["ids"] != [m["name"] for m in members]:
+        raise ValueError(f"{index_path}: {INDEX_FILE}, {META_FILE} и {MEMBERS_FILE} не согласованы — "
+                         f"пересоберите индекс: python 02_build_faiss.py")
+    if nprobe:
+        try:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        except RuntimeError:
+            pass  # не IVF — полный перебор, nprobe не применяется
+
+    docstore = InMemoryDocstore({str(i): Document(page_content=m.get("title", ""), metadata=m)
+                                 for i, m in enumerate(members)})
+    store = FAISS(embeddings, index, docstore, {i: str(i) for i in range(len(members))},
+                  distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT)
+    return store, members
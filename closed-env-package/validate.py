@@ -7,15 +7,42 @@
 
 Запуск:  python validate.py
          python validate.py --fix    (попытается исправить мелкие проблемы)
+         python validate.py --deep   (E2E-тест с генерацией запроса через GigaChat)
 =================================================================
 """
 
 import os
 import sys
+import re
 import json
+import atexit
 import traceback
+import importlib.util
+from functools import lru_cache
 from pathlib import Path
 
+# orjson (опционально) — быстрее stdlib json на кириллице; его JSONDecodeError —
+# подкласс json.JSONDecodeError, так что обработка ошибок не меняется
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _yaml_load(f):
+    """yaml.safe_load через C-парсер libyaml (в разы быстрее), если PyYAML собран с ним"""
+    import yaml
+    return yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+
+def _json_preview(obj, limit=100):
+    text = orjson.dumps(obj).decode() if orjson is not None else json.dumps(obj, ensure_ascii=False)
+    return text[:limit]
+
 # ============================================================
 # Результаты проверок
 # ============================================================
@@ -25,6 +52,20 @@ class Validator:
         self.checks = []
         self.config = None
         self.fix_mode = "--fix" in sys.argv
+        self.deep_mode = "--deep" in sys.argv
+        self._listings = {}
+    
+    def files(self, directory="."):
+        """Содержимое каталога: имя → os.DirEntry. Один os.scandir на каталог за запуск
+        вместо stat на каждый проверяемый файл; нет каталога — пустой dict."""
+        key = str(directory)
+        if key not in self._listings:
+            try:
+                with os.scandir(directory) as it:
+                    self._listings[key] = {e.name: e for e in it}
+            except OSError:
+                self._listings[key] = {}
+        return self._listings[key]
     
     def ok(self, name, detail=""):
         self.checks.append(("OK", name, detail))
@@ -70,6 +111,25 @@ class Validator:
 
 V = Validator()
 
+_HTTP = None
+
+
+def _http():
+    """Один httpx.Client на все проверки: keep-alive соединение с Cube
+    переиспользуется между /meta и /load (check_cube, check_e2e).
+    HTTP/2 — если установлен h2, как и в CubeAPISource загрузчика.
+    """
+    global _HTTP
+    if _HTTP is None:
+        import httpx
+        http2 = importlib.util.find_spec("h2") is not None
+        _HTTP = httpx.Client(
+            timeout=10.0, http2=http2,
+            limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=30.0)
+        )
+        atexit.register(_HTTP.close)
+    return _HTTP
+
 # ============================================================
 # 1. КОНФИГУРАЦИЯ
 # ============================================================
@@ -85,9 +145,8 @@ def check_config():
     V.ok("config.yml существует")
     
     try:
-        import yaml
         with open(config_path, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
+            config = _yaml_load(f)
         V.ok("config.yml парсится")
     except Exception as e:
         V.fail("config.yml парсится", str(e))
@@ -184,6 +243,11 @@ def check_config():
             V.ok(f"faiss.embedding_model: {faiss_cfg['embedding_model']}")
         else:
             V.fail("faiss.embedding_model не указан (нужен для provider=huggingface)")
+        backend = (faiss_cfg.get("backend") or "torch").strip().lower()
+        if backend not in ("torch", "onnx", "onnx-fp16"):
+            V.fail("faiss.backend", f"Допустимые: torch, onnx, onnx-fp16 (указано: {backend})")
+        elif backend != "torch":
+            V.ok(f"faiss.backend: {backend}")
     else:
         V.ok("GigaChat-эмбеддер — учётные данные из секции gigachat")
     
@@ -194,6 +258,47 @@ def check_config():
 # 2. ФАЙЛЫ ПАКЕТА
 # ============================================================
 
+# Хардкод схемы ('public'. / "dbo". и т.п.) и чтение конфига в скриптах пакета
+_SCHEMA_RE = re.compile(r"""["'](?:public|dbo)["']\.""", re.IGNORECASE)
+_CONFIG_RE = re.compile(r"load_config|config\.yml")
+
+# Все признаки в коде ноутбука — одним проходом регулярки (именованные группы)
+_NB_MARKERS_RE = re.compile(
+    r"(?P<gc_base_url>gc\.get\([\"']base_url[\"']\))"
+    r"|(?P<base_url>base_url=)"
+    r"|(?P<glossary_path>glossary_path)"
+    r"|(?P<config_ref>sem\.get|CONFIG)"
+    r"|(?P<abs_path>/home/|/opt/)"
+)
+
+
+@lru_cache(maxsize=None)
+def _read_script(path):
+    """Текст скрипта пакета — читается один раз за запуск (check_files и check_neggo_compat)"""
+    return Path(path).read_text(encoding='utf-8')
+
+
+def _iter_notebook_cells(nb_path):
+    """Ячейки ноутбука по одной: с ijson — потоково, без него — через json.load"""
+    with open(nb_path, 'rb') as f:
+        try:
+            import ijson
+        except ImportError:
+            yield from json.load(f).get("cells", [])
+            return
+        yield from ijson.items(f, "cells.item")
+
+
+@lru_cache(maxsize=None)
+def _read_notebook(nb_path):
+    """Исходники ячеек ноутбука: кортеж (cell_type, source).
+    Outputs (base64-картинки и пр.) не сохраняются — проверкам нужен только код,
+    и ноутбук разбирается один раз за запуск.
+    """
+    return tuple((cell.get("cell_type"), "".join(cell.get("source", [])))
+                 for cell in _iter_notebook_cells(nb_path))
+
+
 def check_files():
     print("\n📋 2. ПРОВЕРКА ФАЙЛОВ ПАКЕТА")
     print("-" * 40)
@@ -204,62 +309,63 @@ def check_files():
         ("02_build_faiss.py", "Скрипт построения FAISS"),
         ("03_agent.ipynb",    "Jupyter-ноутбук агента"),
         ("embedding_utils.py", "Фабрика эмбеддеров (HuggingFace / GigaChat)"),
+        ("faiss_store.py",    "Формат FAISS-индекса: запись и загрузка"),
         ("config.yml",        "Конфигурация"),
         ("cube.env.example",  "Шаблон .env для Cube"),
     ]
     
+    present = V.files()
     for fname, desc in required_files:
-        p = Path(fname)
-        if p.exists():
-            size = p.stat().st_size
+        if fname in present:
+            size = present[fname].stat().st_size
             V.ok(f"{fname} ({size:,} байт)", desc)
         else:
             V.fail(f"{fname} отсутствует", desc)
     
     # Проверка что скрипты используют config, а не хардкод
     for script in ["01_data_loader.py", "02_build_faiss.py"]:
-        if not Path(script).exists():
+        if script not in present:
             continue
-        content = Path(script).read_text(encoding='utf-8')
+        content = _read_script(script)
         
         # Проверяем что нет хардкода схемы
-        hardcoded_schemas = []
-        for marker in ["'public'.", '"public".', "'dbo'.", '"dbo".']:
-            if marker in content.lower() and "schema" not in content[:content.find(marker) + 200]:
-                hardcoded_schemas.append(marker)
+        first_pos = {}
+        for m in _SCHEMA_RE.finditer(content):
+            first_pos.setdefault(m.group().lower(), m.start())
+        hardcoded_schemas = [marker for marker, pos in first_pos.items()
+                             if "schema" not in content[:pos + 200]]
         
         if hardcoded_schemas:
             V.warn(f"{script}: возможный хардкод схемы", 
                    f"Найдено: {hardcoded_schemas}")
         
         # Проверяем что конфиг загружается
-        if "load_config" in content or "config.yml" in content:
+        if _CONFIG_RE.search(content):
             V.ok(f"{script}: использует config.yml")
         else:
             V.fail(f"{script}: не загружает config.yml")
     
     # Проверка ноутбука
-    if Path("03_agent.ipynb").exists():
+    if "03_agent.ipynb" in present:
         try:
-            with open("03_agent.ipynb", 'r', encoding='utf-8') as f:
-                nb = json.load(f)
-            cell_count = len(nb.get("cells", []))
-            V.ok(f"03_agent.ipynb: {cell_count} ячеек, валидный JSON")
+            cells = _read_notebook("03_agent.ipynb")
+            V.ok(f"03_agent.ipynb: {len(cells)} ячеек, валидный JSON")
             
-            # Проверяем что нет хардкода GigaChat
-            all_code = ""
-            for cell in nb["cells"]:
-                if cell.get("cell_type") == "code":
-                    all_code += "".join(cell.get("source", []))
+            # Первое вхождение каждого признака
+            all_code = "".join(source for cell_type, source in cells if cell_type == "code")
+            found = {}
+            for m in _NB_MARKERS_RE.finditer(all_code):
+                found.setdefault(m.lastgroup, m.start())
             
-            if 'gc.get("base_url")' in all_code or "gc.get('base_url')" in all_code:
+            # Проверяем что нет хардкода GigaChat
+            if "gc_base_url" in found:
                 V.ok("03_agent.ipynb: GigaChat режим из конфига")
-            elif "base_url=" in all_code and "config" not in all_code.split("base_url=")[0][-200:]:
+            elif "base_url" in found and "config" not in all_code[max(0, found["base_url"] - 200):found["base_url"]]:
                 V.warn("03_agent.ipynb: возможный хардкод base_url GigaChat")
             
-            if "glossary_path" in all_code and ("sem.get" in all_code or "CONFIG" in all_code):
+            if "glossary_path" in found and "config_ref" in found:
                 V.ok("03_agent.ipynb: пути glossary/examples из конфига")
-            elif "/home/" in all_code or "/opt/" in all_code:
+            elif "abs_path" in found:
                 V.warn("03_agent.ipynb: обнаружены абсолютные пути", 
                        "Перенесите пути в config.yml секцию semantic")
             
@@ -462,13 +568,12 @@ def check_cube():
         return
     
     try:
-        import httpx
         headers = {}
         token = config.get("cube", {}).get("api_token", "")
         if token:
             headers["Authorization"] = f"Bearer {token}"
         
-        client = httpx.Client(timeout=10.0)
+        client = _http()
         resp = client.get(f"{cube_url}/meta", headers=headers)
         
         if resp.status_code == 200:
@@ -524,6 +629,33 @@ def check_cube():
 # 6. ПРОВЕРКА FAISS-ИНДЕКСА
 # ============================================================
 
+# Выше этого размера точный перебор (flat) заметно медленнее IVF при той же полноте
+_FLAT_WARN_MEMBERS = 50_000
+
+
+def _check_index_geometry(index):
+    """Тип индекса и его параметры; предупреждение о полном переборе на большом индексе"""
+    import faiss
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexPreTransform) else index
+    kind = type(base).__name__
+    if isinstance(base, faiss.IndexIVF):
+        V.ok(f"FAISS: {kind}, {index.ntotal:,} векторов", f"nlist={base.nlist}, nprobe={base.nprobe}")
+    elif isinstance(base, faiss.IndexFlat) and index.ntotal > _FLAT_WARN_MEMBERS:
+        V.warn(f"FAISS: точный {kind} на {index.ntotal:,} векторов — полный перебор float32",
+               "Пересоберите с faiss.index_type: auto (ivf/ivfpq) в config.yml")
+    else:
+        V.ok(f"FAISS: {kind}, {index.ntotal:,} векторов")
+
+
+def _search(store, query, k):
+    """Поиск с L2-нормированным запросом: индекс хранит нормированные векторы,
+    score — косинусная близость (больше = ближе)"""
+    import numpy as np
+    vec = np.asarray(store.embeddings.embed_query(query), dtype=np.float32)
+    vec /= np.linalg.norm(vec) or 1.0
+    return store.similarity_search_with_score_by_vector(vec.tolist(), k=k)
+
+
 def check_faiss():
     print("\n📋 6. ПРОВЕРКА FAISS-ИНДЕКСА")
     print("-" * 40)
@@ -541,21 +673,20 @@ def check_faiss():
         return
     
     # Проверяем файлы индекса
-    expected_files = ["index.faiss", "index.pkl", "members.json"]
+    index_files = V.files(index_path)
+    expected_files = ["index.faiss", "index_meta.json", "members.json"]
     for fname in expected_files:
-        fpath = index_path / fname
-        if fpath.exists():
-            size = fpath.stat().st_size
+        if fname in index_files:
+            size = index_files[fname].stat().st_size
             V.ok(f"{fname} ({size:,} байт)")
         else:
             V.fail(f"{fname} отсутствует в {index_path}")
     
     # Проверяем members.json
     members_path = index_path / "members.json"
-    if members_path.exists():
+    if "members.json" in index_files:
         try:
-            with open(members_path, 'r', encoding='utf-8') as f:
-                members = json.load(f)
+            members = _json_loads(members_path.read_bytes())
             
             measures = [m for m in members if m.get("member_type") == "measure"]
             dims = [m for m in members if m.get("member_type") == "dimension"]
@@ -578,18 +709,19 @@ def check_faiss():
     
     # Пробуем загрузить FAISS
     try:
-        from langchain_community.vectorstores import FAISS
         from embedding_utils import create_embeddings
+        from faiss_store import load_store
         
         embeddings = create_embeddings(config)
-        store = FAISS.load_local(str(index_path), embeddings, allow_dangerous_deserialization=True)
+        store, _ = load_store(index_path, embeddings, nprobe=config["faiss"].get("nprobe"))
+        _check_index_geometry(store.index)
         
         # Тестовый поиск
-        results = store.similarity_search_with_score("количество", k=3)
+        results = _search(store, "количество", k=3)
         if results:
             best = results[0]
             V.ok(f"FAISS-поиск работает",
-                 f"'{best[0].metadata.get('name', '?')}' (score={best[1]:.1f})")
+                 f"'{best[0].metadata.get('name', '?')}' (score={best[1]:.2f})")
         else:
             V.warn("FAISS-поиск: 0 результатов")
     
@@ -627,14 +759,13 @@ def check_cube_models():
     
     V.ok(f"Найдено {len(yml_files)} YAML-моделей в {model_path}")
     
-    import yaml
     schema = config.get("database", {}).get("schema", "public")
     issues = []
     
     for yf in yml_files:
         try:
             with open(yf, 'r', encoding='utf-8') as f:
-                data = yaml.safe_load(f)
+                data = _yaml_load(f)
             
             cubes = data.get("cubes", [])
             for cube in cubes:
@@ -671,6 +802,45 @@ def check_cube_models():
 # 8. СКВОЗНОЙ ТЕСТ (end-to-end)
 # ============================================================
 
+# Разбор ответа LLM: обёртка ```json ... ```, «умные» кавычки, JSON-объект в тексте
+_FENCE_RE = re.compile(r"\A```[^\n]*\n|```\Z")
+_QUOTE_TABLE = str.maketrans({"\u201c": '"', "\u201d": '"', "\u00ab": '"', "\u00bb": '"',
+                              "\u2018": "'", "\u2019": "'", "\u00a0": " "})
+
+
+def _e2e_llm_query(gc, best_measure):
+    """--deep: запрос к Cube генерирует GigaChat (полный путь агента: промпт → JSON)"""
+    from langchain_gigachat import GigaChat
+    
+    if gc.get("base_url"):
+        token_env = gc.get("access_token_env", "JPY_API_TOKEN")
+        llm = GigaChat(
+            base_url=gc["base_url"],
+            access_token=os.getenv(token_env, ""),
+            model=gc.get("model", "GigaChat")
+        )
+    else:
+        llm = GigaChat(
+            credentials=gc["credentials"],
+            model=gc.get("model", "GigaChat"),
+            verify_ssl_certs=gc.get("verify_ssl", False),
+            timeout=gc.get("timeout", 60)
+        )
+    
+    prompt = f"""Сгенерируй Cube.js JSON-запрос. Доступная мера: {best_measure}
+Вопрос: сколько всего записей?
+Ответ — ТОЛЬКО JSON: {{"measures": ["{best_measure}"], "limit": 1}}"""
+    
+    content = llm.invoke(prompt).content.strip()
+    
+    # Парсим
+    content = _FENCE_RE.sub("", content).translate(_QUOTE_TABLE)
+    start, end = content.find("{"), content.rfind("}")
+    if start != -1 and end > start:
+        content = content[start:end + 1]
+    return _json_loads(content)
+
+
 def check_e2e():
     print("\n📋 8. СКВОЗНОЙ ТЕСТ (end-to-end)")
     print("-" * 40)
@@ -682,19 +852,20 @@ def check_e2e():
     
     # Нужны: FAISS + GigaChat + Cube
     index_path = Path(config.get("faiss", {}).get("index_path", "./faiss_index"))
-    if not (index_path / "index.faiss").exists():
+    if "index.faiss" not in V.files(index_path):
         V.skip("E2E тест", "FAISS-индекс не найден")
         return
     
+    # GigaChat нужен только для --deep: без него запрос к Cube известен заранее,
+    # а доступность GigaChat уже проверена в разделе 4
     gc = config.get("gigachat", {})
-    if not gc.get("base_url") and not gc.get("credentials"):
+    if V.deep_mode and not gc.get("base_url") and not gc.get("credentials"):
         V.skip("E2E тест", "GigaChat не настроен")
         return
     
     try:
-        import httpx
         cube_url = config["cube"]["api_url"]
-        resp = httpx.get(f"{cube_url}/meta", timeout=5.0)
+        resp = _http().get(f"{cube_url}/meta", timeout=5.0)
         if resp.status_code != 200:
             V.skip("E2E тест", "Cube API недоступен")
             return
@@ -703,62 +874,29 @@ def check_e2e():
         return
     
     try:
-        from langchain_community.vectorstores import FAISS
         from embedding_utils import create_embeddings
-        from langchain_gigachat import GigaChat
+        from faiss_store import load_store
         
         # Загружаем компоненты
         embeddings = create_embeddings(config)
-        store = FAISS.load_local(str(index_path), embeddings, allow_dangerous_deserialization=True)
-        
-        if gc.get("base_url"):
-            token_env = gc.get("access_token_env", "JPY_API_TOKEN")
-            llm = GigaChat(
-                base_url=gc["base_url"],
-                access_token=os.getenv(token_env, ""),
-                model=gc.get("model", "GigaChat")
-            )
-        else:
-            llm = GigaChat(
-                credentials=gc["credentials"],
-                model=gc.get("model", "GigaChat"),
-                verify_ssl_certs=gc.get("verify_ssl", False),
-                timeout=gc.get("timeout", 60)
-            )
+        store, _ = load_store(index_path, embeddings, nprobe=config["faiss"].get("nprobe"))
         
         # FAISS поиск
         test_q = "сколько записей"
-        results = store.similarity_search_with_score(test_q, k=5)
+        results = _search(store, test_q, k=5)
         measures = [r for r in results if r[0].metadata.get("member_type") == "measure"]
         
         if not measures:
             V.warn("E2E: FAISS не нашёл подходящих мер")
             return
         
-        # Формируем простой промпт
         best_measure = measures[0][0].metadata["name"]
-        prompt = f"""Сгенерируй Cube.js JSON-запрос. Доступная мера: {best_measure}
-Вопрос: сколько всего записей?
-Ответ — ТОЛЬКО JSON: {{"measures": ["{best_measure}"], "limit": 1}}"""
-        
-        resp = llm.invoke(prompt)
-        content = resp.content.strip()
-        
-        # Парсим
-        import re
-        if content.startswith("```"):
-            lines = content.split("\n")
-            content = "\n".join(lines[1:])
-            if content.endswith("```"):
-                content = content[:-3]
-        for old, new in [('\u201c', '"'), ('\u201d', '"')]:
-            content = content.replace(old, new)
-        match = re.search(r'\{[\s\S]*\}', content)
-        if match:
-            content = match.group()
-        
-        query = json.loads(content)
-        V.ok(f"E2E: LLM сгенерировал запрос", json.dumps(query, ensure_ascii=False)[:100])
+        if V.deep_mode:
+            query = _e2e_llm_query(gc, best_measure)
+            V.ok(f"E2E: LLM сгенерировал запрос", _json_preview(query))
+        else:
+            query = {"measures": [best_measure], "limit": 1}
+            V.ok(f"E2E: запрос по найденной мере", _json_preview(query))
         
         # Выполняем в Cube
         headers = {"Content-Type": "application/json"}
@@ -766,13 +904,13 @@ def check_e2e():
         if token:
             headers["Authorization"] = f"Bearer {token}"
         
-        client = httpx.Client(timeout=15.0)
-        resp = client.post(
+        resp = _http().post(
             f"{cube_url}/load",
             json={"query": query},
-            headers=headers
+            headers=headers,
+            timeout=15.0
         )
-        result = resp.json()
+        result = _json_loads(resp.content)
         data = result.get("data", [])
         
         if data:
@@ -785,7 +923,7 @@ def check_e2e():
     except ImportError as e:
         V.skip(f"E2E тест: не хватает пакетов", str(e))
     except json.JSONDecodeError as e:
-        V.warn(f"E2E: LLM вернул невалидный JSON", f"{e}, ответ: {content[:100]}")
+        V.warn(f"E2E: LLM вернул невалидный JSON", f"{e}, ответ: {e.doc[:100]}")
     except Exception as e:
         V.warn(f"E2E: {e}")
 
@@ -794,6 +932,28 @@ def check_e2e():
 # 9. СОВМЕСТИМОСТЬ С NEGGO-ОКРУЖЕНИЕМ
 # ============================================================
 
+# Признаки совместимости — одним проходом регулярки по файлу вместо серии `in`
+_COMPAT_MARKERS_RE = re.compile(
+    r"(?P<schema>schema)"
+    r"|(?P<base_url>base_url)"
+    r"|(?P<credentials>credentials)"
+    r"|(?P<duckdb>DuckDBSource|duckdb)"
+    r"|(?P<factory>create_data_source)"
+    r"|(?P<config>config\.yml|load_config)"
+    r"|(?P<abs_path>/home/datalab|/opt/|/tmp/|/root/)"
+)
+
+
+def _compat_markers(content):
+    """Группы _COMPAT_MARKERS_RE, найденные в тексте, и встреченные абсолютные пути"""
+    found, paths = set(), []
+    for m in _COMPAT_MARKERS_RE.finditer(content):
+        found.add(m.lastgroup)
+        if m.lastgroup == "abs_path" and m.group() not in paths:
+            paths.append(m.group())
+    return found, paths
+
+
 def check_neggo_compat():
     """Проверяем что скрипты совместимы с рабочим neggo-окружением"""
     print("\n📋 9. СОВМЕСТИМОСТЬ С ЦЕЛЕВЫМ ОКРУЖЕНИЕМ")
@@ -805,53 +965,54 @@ def check_neggo_compat():
         return
     
     # Проверяем что 01_data_loader.py поддерживает все режимы
-    if Path("01_data_loader.py").exists():
-        content = Path("01_data_loader.py").read_text(encoding='utf-8')
+    present = V.files()
+    if "01_data_loader.py" in present:
+        found, _ = _compat_markers(_read_script("01_data_loader.py"))
         
-        if "get_schema" in content or 'schema' in content:
+        if "schema" in found:
             V.ok("01_data_loader.py: поддерживает database.schema")
         else:
             V.fail("01_data_loader.py: не читает database.schema")
         
-        if "base_url" in content and "credentials" in content:
+        if {"base_url", "credentials"} <= found:
             V.ok("01_data_loader.py: поддерживает оба режима GigaChat")
         else:
             V.warn("01_data_loader.py: проверьте поддержку обоих режимов GigaChat")
         
-        if "DuckDBSource" in content or "duckdb" in content:
+        if "duckdb" in found:
             V.ok("01_data_loader.py: поддерживает DuckDB")
         else:
             V.warn("01_data_loader.py: нет поддержки DuckDB")
         
-        if "create_data_source" in content:
+        if "factory" in found:
             V.ok("01_data_loader.py: универсальная фабрика источников")
         else:
             V.warn("01_data_loader.py: нет фабрики create_data_source")
     
     # Проверяем 02_build_faiss.py
-    if Path("02_build_faiss.py").exists():
-        content = Path("02_build_faiss.py").read_text(encoding='utf-8')
-        if "config.yml" in content or "load_config" in content:
+    if "02_build_faiss.py" in present:
+        found, _ = _compat_markers(_read_script("02_build_faiss.py"))
+        if "config" in found:
             V.ok("02_build_faiss.py: использует config.yml")
         else:
             V.fail("02_build_faiss.py: не использует config.yml")
     
-    # Проверяем 03_agent.ipynb
-    if Path("03_agent.ipynb").exists():
-        with open("03_agent.ipynb", 'r', encoding='utf-8') as f:
-            nb_content = f.read()
+    # Проверяем 03_agent.ipynb — только исходники ячеек (code/markdown), без outputs
+    if "03_agent.ipynb" in present:
+        try:
+            sources = "\n".join(source for cell_type, source in _read_notebook("03_agent.ipynb")
+                                 if cell_type in ("code", "markdown"))
+        except Exception:
+            V.skip("03_agent.ipynb", "невалидный JSON — см. раздел 2")
+            return
+        found, hardcoded_paths = _compat_markers(sources)
         
-        if "base_url" in nb_content and "credentials" in nb_content:
+        if {"base_url", "credentials"} <= found:
             V.ok("03_agent.ipynb: поддерживает оба режима GigaChat")
         else:
             V.warn("03_agent.ipynb: проверьте поддержку обоих режимов GigaChat")
         
         # Проверяем на хардкод путей
-        hardcoded_paths = []
-        for marker in ["/home/datalab", "/opt/", "/tmp/", "/root/"]:
-            if marker in nb_content:
-                hardcoded_paths.append(marker)
-        
         if hardcoded_paths:
             V.warn(f"03_agent.ipynb: хардкод путей: {hardcoded_paths}",
                    "Перенесите в config.yml")
@@ -6,6 +6,9 @@
 FAISS-индекс с эмбеддингами для семантического поиска.
 
 Запуск: python 02_build_faiss.py
+        python 02_build_faiss.py --bootstrap   (доустановить пакеты через pip)
+        SKIP_BOOTSTRAP=1 python 02_build_faiss.py   (не проверять пакеты — образ/CI
+                                                     с уже установленными зависимостями)
 =================================================================
 """
 
@@ -13,18 +16,40 @@ import os
 import sys
 import json
 import subprocess
-import pickle
+import importlib.util
 from pathlib import Path
-from dataclasses import dataclass
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, NamedTuple
 
 # ============================================================
-# Автоустановка зависимостей
+# Проверка зависимостей
 # ============================================================
 
-def _ensure_packages():
-    """Проверить и установить недостающие пакеты (включая FAISS)"""
-    # Сначала проверим наличие torch (CPU) — нужен для sentence-transformers
+# Маркер успешной проверки: пока он новее интерпретатора (venv не пересоздавали),
+# повторные запуски пропускают проверку пакетов
+_DEPS_MARKER = Path(__file__).with_name(".deps_ok")
+
+
+def _deps_checked():
+    try:
+        return _DEPS_MARKER.stat().st_mtime > os.stat(sys.executable).st_mtime
+    except OSError:
+        return False
+
+
+def _mark_deps_ok():
+    try:
+        _DEPS_MARKER.touch()
+    except OSError:
+        pass  # папка скрипта только для чтения — просто проверим в следующий раз
+
+
+def _ensure_packages(install=False):
+    """Проверить наличие пакетов (включая FAISS) без импорта и без запуска pip.
+    Если чего-то нет — завершиться с подсказкой; с флагом --bootstrap — доустановить.
+    SKIP_BOOTSTRAP=1 в окружении отключает проверку.
+    """
+    if os.environ.get("SKIP_BOOTSTRAP") or _deps_checked():
+        return
     required = {
         "yaml": "pyyaml",
         "httpx": "httpx",
@@ -33,38 +58,39 @@ def _ensure_packages():
         "langchain_community": "langchain-community",
         "langchain": "langchain",
         "sentence_transformers": "sentence-transformers",
+        "torch": "torch",  # нужен для sentence-transformers
     }
-    missing = []
-    for module, pip_name in required.items():
-        try:
-            __import__(module)
-        except ImportError:
-            missing.append(pip_name)
-
-    # Проверяем torch отдельно — ставим CPU-версию если нет
-    try:
-        import torch
-    except ImportError:
-        missing.append("torch")
-
-    if missing:
-        print(f"📦 Установка недостающих пакетов: {', '.join(missing)}")
-        cmd = [sys.executable, "-m", "pip", "install", "--quiet"]
-        # Если нужен torch, ставим CPU-версию для экономии места
-        torch_needed = "torch" in missing
-        other = [p for p in missing if p != "torch"]
-        if torch_needed:
-            print("   ⚡ PyTorch будет установлен в CPU-версии (без CUDA)")
-            subprocess.check_call(
-                cmd + ["torch", "--index-url", "https://download.pytorch.org/whl/cpu"]
-            )
-        if other:
-            subprocess.check_call(cmd + other)
-        print("✅ Все пакеты установлены")
-
-_ensure_packages()
+    missing = [pip_name for module, pip_name in required.items()
+               if importlib.util.find_spec(module) is None]
+    if not missing:
+        _mark_deps_ok()
+        return
+    if not install:
+        print(f"❌ Не установлены пакеты: {', '.join(missing)}")
+        print(f"   Установите: pip install -r requirements.txt")
+        print(f"   или запустите скрипт с флагом --bootstrap")
+        sys.exit(1)
+
+    print(f"📦 Установка недостающих пакетов: {', '.join(missing)}")
+    cmd = [sys.executable, "-m", "pip", "install", "--quiet"] + missing
+    # Если нужен torch, ставим CPU-версию для экономии места: сборки +cpu
+    # из доп. индекса PyTorch выигрывают у CUDA-сборок с PyPI. Всё одним вызовом pip.
+    if "torch" in missing:
+        print("   ⚡ PyTorch будет установлен в CPU-версии (без CUDA)")
+        cmd += ["--extra-index-url", "https://download.pytorch.org/whl/cpu"]
+    subprocess.check_call(cmd)
+    _mark_deps_ok()
+    print("✅ Все пакеты установлены")
+
+_ensure_packages(install="--bootstrap" in sys.argv)
 
 import yaml
+
+# C-парсер libyaml в 5-10 раз быстрее чистого Python; если PyYAML собран без него — fallback
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
 import httpx
 
 # ============================================================
@@ -73,15 +99,16 @@ import httpx
 
 def load_config(config_path="config.yml"):
     with open(config_path, 'r', encoding='utf-8') as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=_YamlLoader)
 
 
 # ============================================================
 # Структура метаданных
 # ============================================================
 
-@dataclass
-class CubeMember:
+# NamedTuple вместо dataclass: без __dict__ у каждого экземпляра (в разы меньше памяти
+# на десятках тысяч мемберов), поля в том же порядке, что и ключи members.json
+class CubeMember(NamedTuple):
     name: str
     title: str
     type: str
@@ -95,6 +122,64 @@ class CubeMember:
 # Загрузка метаданных Cube
 # ============================================================
 
+# Один клиент на процесс: пул соединений переиспользуется между запросами к Cube
+_http = httpx.Client(timeout=30.0)
+
+
+def _iter_cubes(resp):
+    """Кубы из ответа /meta по мере поступления байтов.
+    С ijson JSON разбирается потоково (в памяти — один куб, а не весь ответ);
+    без него — обычный resp.json().
+    """
+    try:
+        import ijson
+    except ImportError:
+        resp.read()
+        yield from resp.json().get("cubes", [])
+        return
+    
+    cubes = ijson.sendable_list()
+    parser = ijson.items_coro(cubes, "cubes.item", use_float=True)
+    for chunk in resp.iter_bytes():
+        parser.send(chunk)
+        yield from cubes
+        del cubes[:]
+    parser.close()
+    yield from cubes
+
+
+def _cube_members(cube):
+    """Видимые меры и измерения одного куба"""
+    cube_name = cube["name"]
+    
+    for measure in cube.get("measures", []):
+        if not measure.get("isVisible", True):
+            continue
+        title = measure.get("shortTitle") or measure.get("title", measure["name"])
+        yield CubeMember(
+            name=measure["name"],
+            title=title,
+            type=measure.get("type", "number"),
+            cube_name=cube_name,
+            member_type="measure",
+            description=measure.get("description", ""),
+            agg_type=measure.get("aggType", "")
+        )
+    
+    for dim in cube.get("dimensions", []):
+        if not dim.get("isVisible", True):
+            continue
+        title = dim.get("shortTitle") or dim.get("title", dim["name"])
+        yield CubeMember(
+            name=dim["name"],
+            title=title,
+            type=dim.get("type", "string"),
+            cube_name=cube_name,
+            member_type="dimension",
+            description=dim.get("description", "")
+        )
+
+
 def load_cube_metadata(config) -> List[CubeMember]:
     """Загрузить метаданные из Cube REST API /meta"""
     cube_url = config["cube"]["api_url"]
@@ -107,41 +192,11 @@ def load_cube_metadata(config) -> List[CubeMember]:
     url = f"{cube_url}/meta"
     print(f"🔄 Загрузка метаданных: {url}")
     
-    client = httpx.Client(timeout=30.0)
-    resp = client.get(url, headers=headers)
-    resp.raise_for_status()
-    metadata = resp.json()
-    
     members = []
-    for cube in metadata.get("cubes", []):
-        cube_name = cube["name"]
-        
-        for measure in cube.get("measures", []):
-            if not measure.get("isVisible", True):
-                continue
-            title = measure.get("shortTitle") or measure.get("title", measure["name"])
-            members.append(CubeMember(
-                name=measure["name"],
-                title=title,
-                type=measure.get("type", "number"),
-                cube_name=cube_name,
-                member_type="measure",
-                description=measure.get("description", ""),
-                agg_type=measure.get("aggType", "")
-            ))
-        
-        for dim in cube.get("dimensions", []):
-            if not dim.get("isVisible", True):
-                continue
-            title = dim.get("shortTitle") or dim.get("title", dim["name"])
-            members.append(CubeMember(
-                name=dim["name"],
-                title=title,
-                type=dim.get("type", "string"),
-                cube_name=cube_name,
-                member_type="dimension",
-                description=dim.get("description", "")
-            ))
+    with _http.stream("GET", url, headers=headers) as resp:
+        resp.raise_for_status()
+        for cube in _iter_cubes(resp):
+            members.extend(_cube_members(cube))
     
     return members
 
@@ -150,78 +205,180 @@ def load_cube_metadata(config) -> List[CubeMember]:
 # Построение FAISS-индекса
 # ============================================================
 
+# Пороги для faiss.index_type: auto — с какого числа мемберов строить IVF / IVF-PQ
+IVF_MIN_MEMBERS = 5000
+IVFPQ_MIN_MEMBERS = 100_000
+
+INDEX_TYPES = ("auto", "flat", "fp16", "sq8", "ivf", "ivfpq")
+
+# Размерность после PCA (faiss.pca_dim, 0 — без PCA)
+PCA_DIM = 256
+
+
+def _create_faiss_index(vectors, config):
+    """Создать faiss-индекс; при достаточном числе мемберов — со сжатием PCA.
+    
+    Векторы проецируются на первые faiss.pca_dim главных компонент и заново
+    L2-нормируются: расстояния считаются в 256 измерениях вместо 384-1024.
+    IndexPreTransform применяет ту же проекцию к векторам при add и к запросам
+    при search, так что вызывающий код передаёт исходные эмбеддинги.
+    PCA не обучается, если мемберов меньше 2·d (ковариация не оценится).
+    """
+    import faiss
+    
+    n, d = vectors.shape
+    pca_dim = config["faiss"].get("pca_dim", PCA_DIM)
+    if not pca_dim or pca_dim >= d or n < 2 * d:
+        return _create_base_index(vectors, config)
+    
+    print(f"🔄 Обучение PCA {d} → {pca_dim}...")
+    pca = faiss.PCAMatrix(d, pca_dim)
+    pca.train(vectors)
+    reduced = pca.apply(vectors)
+    faiss.normalize_L2(reduced)
+    
+    index = faiss.IndexPreTransform(_create_base_index(reduced, config))
+    index.prepend_transform(faiss.NormalizationTransform(pca_dim, 2.0))
+    index.prepend_transform(pca)
+    return index
+
+
+def _create_base_index(vectors, config):
+    """Создать (и обучить, если нужно) faiss-индекс.
+    Векторы L2-нормированы, поэтому метрика — inner product (= косинус):
+    тот же порядок, что у L2, но без вычисления расстояния.
+    
+    faiss.index_type:
+      flat  — точный IndexFlatIP (float32);
+      fp16  — IndexScalarQuantizer fp16: вдвое меньше index.faiss и RAM, точность почти как flat;
+      sq8   — IndexScalarQuantizer 8 бит: в 4 раза меньше памяти, полный перебор;
+      ivf   — IndexIVFFlat: nlist ≈ 4·√N кластеров, поиск по faiss.nprobe ближайшим;
+      ivfpq — IndexIVFPQ: IVF + product quantization (d/4 подвекторов по 8 бит);
+      auto  — fp16 до IVF_MIN_MEMBERS, ivf до IVFPQ_MIN_MEMBERS, дальше ivfpq (default).
+    """
+    import faiss
+    
+    n, d = vectors.shape
+    index_type = config["faiss"].get("index_type", "auto")
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"faiss.index_type: {index_type!r}, ожидается одно из {INDEX_TYPES}")
+    if index_type == "auto":
+        index_type = ("fp16" if n < IVF_MIN_MEMBERS else
+                      "ivf" if n < IVFPQ_MIN_MEMBERS else "ivfpq")
+    
+    # PQ-кодбукам (256 центроидов) нужно >= 39·256 обучающих векторов
+    if index_type == "ivfpq" and n < 39 * 256:
+        print(f"   ⚠️ Мало векторов для IVF-PQ ({n}), используется sq8")
+        index_type = "sq8"
+    
+    if index_type == "flat":
+        return faiss.IndexFlatIP(d)
+    
+    if index_type == "fp16":
+        # fp16 не требует обучения: значения просто хранятся в половинной точности
+        return faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16,
+                                          faiss.METRIC_INNER_PRODUCT)
+    
+    if index_type == "sq8":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit,
+                                           faiss.METRIC_INNER_PRODUCT)
+        print("🔄 Обучение SQ8-квантизатора...")
+        index.train(vectors)
+        return index
+    
+    nlist = max(1, min(int(4 * n ** 0.5), n // 39))  # faiss просит >= 39 точек на кластер
+    quantizer = faiss.IndexFlatIP(d)
+    if index_type == "ivfpq":
+        m = max(k for k in range(1, d // 4 + 1) if d % k == 0)  # число подвекторов делит d
+        index = faiss.IndexIVFPQ(quantizer, d, nlist, m, 8, faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+    if _use_gpu(config):
+        # k-means обучения IVF — на GPU; сам индекс остаётся CPU-шным
+        index.clustering_index = faiss.index_cpu_to_all_gpus(faiss.IndexFlatL2(d))
+    print(f"🔄 Обучение {index_type.upper()}-индекса (nlist={nlist})...")
+    index.train(vectors)
+    index.nprobe = config["faiss"].get("nprobe", 16)
+    return index
+
+
+def _use_gpu(config):
+    """faiss.use_gpu включён и есть GPU (нужен пакет faiss-gpu вместо faiss-cpu)"""
+    import faiss
+    return bool(config["faiss"].get("use_gpu")) and faiss.get_num_gpus() > 0
+
+
+def _index_to_gpu(index):
+    """Копия индекса на всех GPU для add; None — если этот тип индекса на GPU не переносится"""
+    import faiss
+    try:
+        return faiss.index_cpu_to_all_gpus(index)
+    except RuntimeError as e:
+        print(f"   ⚠️ {type(index).__name__} не переносится на GPU, добавление на CPU: {e}")
+        return None
+
+
 def build_faiss_index(members: List[CubeMember], config):
-    """Построить FAISS-индекс с эмбеддингами метаданных"""
+    """Построить FAISS-индекс с эмбеддингами метаданных.
+    Векторы добавляются прямо в faiss-индекс в порядке members — без LangChain-обёртки
+    и Document на каждый мембер; метаданные по позиции вектора берутся из members.
+    """
     
-    from langchain_community.vectorstores import FAISS
-    from langchain_core.documents import Document
+    import faiss
+    import numpy as np
     from embedding_utils import create_embeddings
     
     print(f"🔄 Загрузка модели эмбеддингов...")
     embeddings = create_embeddings(config)
     
-    print(f"🔄 Создание документов ({len(members)} members)...")
-    documents = []
+    print(f"🔄 Подготовка текстов ({len(members)} members)...")
+    # Текст для эмбеддинга: title + description + контекст
+    texts = [
+        m.title
+        + (f". {m.description}" if m.description else "")
+        + f". Куб: {m.cube_name}. Тип: {m.member_type}, {m.type}"
+        + (f". Агрегация: {m.agg_type}" if m.agg_type else "")
+        for m in members
+    ]
     
-    for m in members:
-        # Текст для эмбеддинга: title + description + контекст
-        parts = [m.title]
-        if m.description:
-            parts.append(m.description)
-        parts.append(f"Куб: {m.cube_name}")
-        parts.append(f"Тип: {m.member_type}, {m.type}")
-        if m.agg_type:
-            parts.append(f"Агрегация: {m.agg_type}")
-        text = ". ".join(parts)
-        
-        doc = Document(
-            page_content=text,
-            metadata={
-                "name": m.name,
-                "title": m.title,
-                "type": m.type,
-                "cube_name": m.cube_name,
-                "member_type": m.member_type,
-                "agg_type": m.agg_type,
-                "description": m.description
-            }
-        )
-        documents.append(doc)
+    # Все тексты — одним батчевым вызовом модели (faiss.batch_size в config.yml).
+    # SentenceTransformer.encode сам сортирует тексты по длине и паддит батч до самого
+    # длинного в нём (padding="longest"), поэтому заранее сортировать здесь не нужно.
+    print(f"🔄 Вычисление эмбеддингов (batch_size={config['faiss'].get('batch_size', 64)})...")
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    faiss.normalize_L2(vectors)
     
     print(f"🔄 Построение FAISS-индекса...")
-    store = FAISS.from_documents(documents, embeddings)
+    index = _create_faiss_index(vectors, config)
+    if config["faiss"].get("use_gpu") and not _use_gpu(config):
+        print("   ⚠️ faiss.use_gpu: GPU не найден (или установлен faiss-cpu), индекс строится на CPU")
+    gpu_index = _index_to_gpu(index) if _use_gpu(config) else None
+    if gpu_index is not None:
+        gpu_index.add(vectors)
+        # write_index умеет сохранять только CPU-индекс
+        index = faiss.index_gpu_to_cpu(gpu_index)
+    else:
+        index.add(vectors)
+    if isinstance(index, faiss.IndexPreTransform):
+        base = faiss.downcast_index(index.index)
+        print(f"   Тип индекса: {type(base).__name__} (PCA {index.d} → {base.d})")
+    else:
+        print(f"   Тип индекса: {type(index).__name__}")
     
-    return store, members
+    return index, embeddings
 
 
-def save_faiss_index(store, members, config):
-    """Сохранить FAISS-индекс и метаданные на диск"""
-    index_path = Path(config["faiss"]["index_path"])
-    index_path.mkdir(parents=True, exist_ok=True)
-    
-    # Сохранить FAISS
-    store.save_local(str(index_path))
+def save_faiss_index(index, members, config):
+    """Сохранить FAISS-индекс и метаданные на диск (формат — в faiss_store.py)"""
+    from faiss_store import save_index
     
-    # Сохранить метаданные members
-    members_data = []
-    for m in members:
-        members_data.append({
-            "name": m.name,
-            "title": m.title,
-            "type": m.type,
-            "cube_name": m.cube_name,
-            "member_type": m.member_type,
-            "description": m.description,
-            "agg_type": m.agg_type
-        })
-    
-    with open(index_path / "members.json", 'w', encoding='utf-8') as f:
-        json.dump(members_data, f, ensure_ascii=False, indent=2)
+    index_path = Path(config["faiss"]["index_path"])
+    save_index(index, [m._asdict() for m in members], index_path)
     
     print(f"💾 Индекс сохранён: {index_path}/")
-    print(f"   - index.faiss    (векторный индекс)")
-    print(f"   - index.pkl      (метаданные документов)")
-    print(f"   - members.json   (метаданные Cube-мемберов)")
+    print(f"   - index.faiss      (векторный индекс)")
+    print(f"   - index_meta.json  (заголовок: размер, тип индекса, ids)")
+    print(f"   - members.json     (метаданные Cube-мемберов)")
 
 
 # ============================================================
@@ -242,25 +399,38 @@ def main():
     members = load_cube_metadata(config)
     print(f"✅ Загружено: {len(members)} мемберов")
     
-    measures = [m for m in members if m.member_type == "measure"]
-    dimensions = [m for m in members if m.member_type == "dimension"]
-    cubes = set(m.cube_name for m in members)
-    print(f"   Кубов: {len(cubes)}, Мер: {len(measures)}, Измерений: {len(dimensions)}")
+    n_measures = n_dimensions = 0
+    cubes = set()
+    for m in members:
+        cubes.add(m.cube_name)
+        if m.member_type == "measure":
+            n_measures += 1
+        else:
+            n_dimensions += 1
+    print(f"   Кубов: {len(cubes)}, Мер: {n_measures}, Измерений: {n_dimensions}")
     print()
     
     # 2. Построить индекс
-    store, members = build_faiss_index(members, config)
+    index, embeddings = build_faiss_index(members, config)
     print("✅ FAISS-индекс построен")
     
     # 3. Сохранить
-    save_faiss_index(store, members, config)
+    save_faiss_index(index, members, config)
     
     # 4. Тест поиска
     print()
-    print("🔍 Тестовый поиск: 'количество задач по проектам'")
-    results = store.similarity_search_with_score("количество задач по проектам", k=5)
-    for doc, score in results:
-        print(f"   {score:.2f} | {doc.metadata['name']:40} | {doc.metadata['title']}")
+    # score — косинусная близость (inner product нормированных векторов): больше = ближе,
+    # в отличие от прежнего L2-расстояния, где ближе было меньшее значение
+    import faiss
+    import numpy as np
+    print("🔍 Тестовый поиск: 'количество задач по проектам' (score: больше = ближе)")
+    query = np.asarray([embeddings.embed_query("количество задач по проектам")], dtype=np.float32)
+    faiss.normalize_L2(query)
+    scores, ids = index.search(query, 5)
+    for score, i in zip(scores[0], ids[0]):
+        if i >= 0:
+            m = members[i]
+            print(f"   {score:.2f} | {m.name:40} | {m.title}")
     
     print()
     print("=" * 60)
@@ -4,6 +4,8 @@
 get_sample_data, get_row_count, close.
 """
 
+import copy
+
 from sqlalchemy import create_engine, text, inspect
 from sqlalchemy.engine import Engine
 from typing import List, Any
@@ -113,6 +115,7 @@ class SQLAlchemySource:
     def __init__(self, engine: Engine, schema: str):
         self.engine = engine
         self.schema = schema
+        self._owns_engine = True
 
     def get_tables(self):
         insp = inspect(self.engine)
@@ -169,8 +172,16 @@ class SQLAlchemySource:
             r = conn.execute(text(f"SELECT COUNT(*) FROM {full}"))
             return r.scalar() or 0
 
+    def clone(self):
+        """Копия для другого потока (introspect_tables). Engine и его пул соединений
+        потокобезопасны, поэтому копия делит engine с исходным источником и не закрывает его."""
+        other = copy.copy(self)
+        other._owns_engine = False
+        return other
+
     def close(self):
-        self.engine.dispose()
+        if self._owns_engine:
+            self.engine.dispose()
         
     def execute(self, sql: str, params: List[Any]) -> List[List[Any]]:
         import re
@@ -207,7 +218,23 @@ class GreenplumSource(SQLAlchemySource):
         engine = _create_greenplum_engine(config)
         schema = config.get("database", {}).get("schema", "public")
         super().__init__(engine, schema)
+        self.exact_counts = config.get("database", {}).get("exact_counts", False)
         print(f"✅ Greenplum (SQLAlchemy): {config['database'].get('host')} (schema={self.schema})")
+
+    def get_row_count(self, table_name: str):
+        """Оценка из pg_class.reltuples (Greenplum обновляет её при ANALYZE) вместо
+        полного COUNT(*); точный подсчёт — при database.exact_counts или если оценки нет."""
+        if not self.exact_counts:
+            with self.engine.connect() as conn:
+                count = conn.execute(text("""
+                    SELECT c.reltuples::bigint
+                    FROM pg_class c
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE n.nspname = :schema AND c.relname = :table
+                """), {"schema": self.schema, "table": table_name}).scalar()
+            if count and count > 0:
+                return count
+        return super().get_row_count(table_name)
         
     def get_tables(self):
         with self.engine.connect() as conn:
@@ -4,6 +4,7 @@
 """
 
 import os
+from functools import lru_cache
 
 
 def create_embeddings(config: dict):
@@ -22,10 +23,54 @@ def create_embeddings(config: dict):
 
 
 def _create_huggingface_embeddings(config: dict):
+    faiss_cfg = config["faiss"]
+    # Весь список текстов кодируется одним вызовом encode() пачками по batch_size
+    return _huggingface_embeddings(
+        faiss_cfg["embedding_model"],
+        faiss_cfg.get("batch_size", 64),
+        faiss_cfg.get("model_cache_dir"),
+        (faiss_cfg.get("backend") or "torch").strip().lower(),
+        "cuda" if faiss_cfg.get("use_gpu") else None,
+    )
+
+
+# faiss.backend → аргументы SentenceTransformer (sentence-transformers >= 3.2).
+# onnx — ONNX Runtime на CPU (pip install "sentence-transformers[onnx]"), обычно в 2-3 раза
+# быстрее PyTorch; onnx-fp16 — готовый экспорт модели с оптимизацией O4 (fp16) для GPU.
+_HF_BACKENDS = {
+    "torch": {},
+    "onnx": {"backend": "onnx"},
+    "onnx-fp16": {
+        "backend": "onnx",
+        "model_kwargs": {"file_name": "onnx/model_O4.onnx", "provider": "CUDAExecutionProvider"},
+    },
+}
+
+
+@lru_cache(maxsize=4)
+def _huggingface_embeddings(model_name: str, batch_size: int, cache_folder: str = None,
+                            backend: str = "torch", device: str = None):
+    """Модель грузится один раз на процесс: повторные create_embeddings
+    (например, check_faiss и check_e2e в validate.py) получают тот же объект.
+    cache_folder — постоянный каталог весов вместо ~/.cache (faiss.model_cache_dir).
+    Векторы L2-нормируются внутри encode() — индекс (inner product) хранит нормированные,
+    и запросы из ноутбука сразу дают косинусную близость без нормировки на стороне FAISS.
+    """
     from langchain_community.embeddings import HuggingFaceEmbeddings
 
-    model_name = config["faiss"]["embedding_model"]
-    return HuggingFaceEmbeddings(model_name=model_name)
+    if backend not in _HF_BACKENDS:
+        raise ValueError(f"faiss.backend: {backend!r}, допустимые: {', '.join(_HF_BACKENDS)}")
+
+    model_kwargs = dict(_HF_BACKENDS[backend])
+    if device:
+        model_kwargs["device"] = device  # faiss.use_gpu; без него sentence-transformers выбирает сам
+
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        cache_folder=cache_folder,
+        model_kwargs=model_kwargs,
+        encode_kwargs={"batch_size": batch_size, "normalize_embeddings": True},
+    )
 
 
 def _create_gigachat_embeddings(config: dict):
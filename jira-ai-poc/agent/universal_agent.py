@@ -301,6 +301,15 @@ class CubeVectorStore:
 # LLM Query Generator
 # ============================================
 
+# Typographic quotes / NBSP in LLM output -> ASCII, one str.translate pass
+_LLM_QUOTE_TABLE = str.maketrans({
+    "\u201c": '"', "\u201d": '"',   # smart double quotes
+    "\u2018": "'", "\u2019": "'",   # smart single quotes
+    "\u00ab": '"', "\u00bb": '"',   # guillemets
+    "\u00a0": " ",                  # NBSP (not valid JSON whitespace)
+})
+
+
 class CubeQueryGenerator:
     """Generate Cube queries using LLM with dynamic prompts"""
     
@@ -337,28 +346,8 @@ class CubeQueryGenerator:
         try:
             content = content.strip()
             
-            # Replace typographic quotes with ASCII quotes (GigaChat uses Unicode quotes)
-            # Handle both direct Unicode and UTF-8 encoded versions
-            quote_replacements = [
-                ('"', '"'), ('"', '"'),  # U+201C, U+201D (smart double quotes)
-                (''', "'"), (''', "'"),  # U+2018, U+2019 (smart single quotes)
-                ('«', '"'), ('»', '"'),  # Guillemets
-                ('\u201c', '"'), ('\u201d', '"'),  # Explicit Unicode escapes
-                ('\u2018', "'"), ('\u2019', "'"),
-            ]
-            for old, new in quote_replacements:
-                content = content.replace(old, new)
-            
-            # Also handle if content was read as raw bytes (UTF-8 sequences)
-            try:
-                # Try to decode if content contains raw UTF-8 byte sequences
-                if any(ord(c) > 127 for c in content):
-                    # Re-encode and decode to normalize Unicode
-                    content = content.encode('utf-8').decode('utf-8')
-                    for old, new in quote_replacements:
-                        content = content.replace(old, new)
-            except (UnicodeDecodeError, UnicodeEncodeError):
-                pass
+            # Replace typographic quotes and NBSP with ASCII (GigaChat uses Unicode quotes)
+            content = content.translate(_LLM_QUOTE_TABLE)
             
             # Remove markdown code blocks (handle both ``` and ```json)
             if "```" in content:
@@ -392,11 +381,11 @@ class CubeQueryGenerator:
             except json.JSONDecodeError:
                 pass
             
-            # Try to extract JSON object using regex (handles nested objects)
-            json_match = re.search(r'\{[\s\S]*\}', cleaned)
-            if json_match:
+            # Try to extract JSON object: first '{' to last '}' (handles nested objects)
+            start, end = cleaned.find('{'), cleaned.rfind('}')
+            if start != -1 and end > start:
                 try:
-                    result = json.loads(json_match.group())
+                    result = json.loads(cleaned[start:end + 1])
                     return self._normalize_cube_query(result)
                 except json.JSONDecodeError:
                     pass